@@ -7,7 +7,6 @@ Pearson correlation based recommendations.
 
 import collections
 import io
-import itertools
 import logging
 import math
 import sys
@@ -35,10 +34,47 @@ def pearson(rated_items_1: dict, rated_items_2: dict) -> float:
     return (p_sum - sum_1 * sum_2 / n) / denominator
 
 
+def train_model(records, account_id: int, train_items: dict):
+    """
+    Accumulates similarity sums and the model over account records.
+    """
+    similarity_sums = collections.Counter()
+    model = collections.Counter()
+    for _account_id, tanks in records:
+        if _account_id == account_id:
+            continue
+        other_rated_items = {tank.tank_id: tank.wins / tank.battles for tank in tanks}
+        similarity = pearson(train_items, other_rated_items)
+        if similarity <= 0.0:
+            continue
+        for tank_id, my_rating in other_rated_items.items():
+            similarity_sums[tank_id] += similarity
+            model[tank_id] += similarity * my_rating
+    return similarity_sums, model
+
+
+def train_partition(dump: str, partition: kit.Partition, make_reader, account_id: int, train_items: dict):
+    """
+    Trains the model over the dump partition in a worker process.
+    """
+    with open(dump, "rb") as fp:
+        reader = make_reader(fp)
+        return train_model(kit.read_partition(reader, partition), account_id, train_items)
+
+
+def log_progress(reader: kit.DumpReader):
+    for i, record in enumerate(reader):
+        if i % 1000 == 0:
+            logging.info("#%d | input: %.1fMiB", i, reader.tell() / kit.MB)
+        yield record
+
+
 @click.command()
-@click.argument("input_", type=click.File("rb"))
+@kit.dump_reader_options
+@click.option("-j", "--jobs", default=1, help="Worker processes.", metavar="<n>", type=int)
+@click.argument("input_", type=kit.DumpFile("rb"))
 @click.argument("account_id", type=int)
-def main(input_: io.IOBase, account_id: int):
+def main(make_reader, jobs: int, input_: io.IOBase, account_id: int):
     """
     Train and evaluate Pearson based recommendations.
     """
@@ -61,24 +97,19 @@ def main(input_: io.IOBase, account_id: int):
     test_items = dict(train_items.popitem() for _ in range(len(train_items) // 5))
     logging.info("%d train items. %d test items.", len(train_items), len(test_items))
 
-    similarity_sums = collections.Counter()
-    model = collections.Counter()
-    for i in itertools.count():
-        if i % 1000 == 0:
-            logging.info("#%d | input: %.1fMiB", i, input_.tell() / kit.MB)
-        stats = kit.read_account_stats(input_)
-        if not stats:
-            break
-        _account_id, tanks = stats
-        if _account_id == account_id:
-            continue
-        other_rated_items = {tank.tank_id: tank.wins / tank.battles for tank in tanks}
-        similarity = pearson(train_items, other_rated_items)
-        if similarity <= 0.0:
-            continue
-        for tank_id, my_rating in other_rated_items.items():
-            similarity_sums[tank_id] += similarity
-            model[tank_id] += similarity * my_rating
+    if jobs > 1:
+        similarity_sums = collections.Counter()
+        model = collections.Counter()
+        partitions = kit.make_partitions(input_, jobs)
+        results = kit.map_partitions(
+            train_partition, input_.name, partitions, jobs, make_reader, account_id, train_items)
+        for i, (partition, (partition_sums, partition_model)) in enumerate(zip(partitions, results), 1):
+            similarity_sums.update(partition_sums)
+            model.update(partition_model)
+            logging.info("#%d/%d | input: %.1fMiB", i, len(partitions), partition.end / kit.MB)
+    else:
+        reader = make_reader(input_)
+        similarity_sums, model = train_model(log_progress(reader), account_id, train_items)
 
     print("Model Predictions:")
     print()
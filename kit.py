@@ -1,31 +1,56 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
+import array
 import asyncio
+import bisect
+import bz2
 import collections
+import concurrent.futures
 import csv
+import gzip
 import http.client
+import heapq
+import io
 import itertools
+import json
 import logging
+import lzma
+import mmap
+import multiprocessing
 import os
+import queue
+import re
+import struct
 import sys
+import tempfile
+import threading
 import typing
+import zlib
 
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import partial, wraps
 from operator import attrgetter, itemgetter
 from time import time
-from random import normalvariate
+from random import normalvariate, randrange
 
 import aiohttp
 import click
 
+from aiohttp import web
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import encyclopedia
 
 
 # Pre-defines.
 # ------------------------------------------------------------------------------
 
+API_URL = "http://api.worldoftanks.ru/wot"
 MAX_IDS_PER_REQUEST = 100
 
 AUTO_ADAPT_REQUEST_COUNT = 150
@@ -35,8 +60,74 @@ MIN_PENDING_COUNT = 1
 DEFAULT_PENDING_COUNT = 8
 MAX_PENDING_COUNT = 32
 
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+RATE_DECREASE_COOLDOWN = 1.0
+SLOW_RESPONSE_TIME = 3.0
+
+KEY_FAILURE_LIMIT = 10
+KEY_SIDELINE_TIME = 60.0
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+RETRY_BUCKETS = (0, 1, 2, 4, 8, 16)
+METRICS_INTERVAL = 10.0
+
+HEDGE_PERCENTILE = 0.95
+HEDGE_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 20
+
+# Segments are sorted in memory, which takes about 60 times the segment size.
+SPILL_SEGMENT_SIZE = 1048576
+SPILL_MERGE_FAN_IN = 64
+SPILL_BLOCK_SIZE = 65536
+
 TANK_ID_BLACKLIST = {64513, 64833, 64545}
 
+BLOCK_SIZE = 4 * 1048576
+
+DUMP_BLOCK_SIZE = 1048576
+
+# Decoded blocks take about 60 times their size, so merge inputs are decoded by small blocks.
+MERGE_BLOCK_SIZE = 65536
+
+FORMATS = click.IntRange(1, 2)
+LAYOUTS = ("columns", "rows")
+
+CODECS = collections.OrderedDict([
+    ("lzma", (lzma.compress, lzma.decompress)),
+    ("zlib", (zlib.compress, zlib.decompress)),
+])
+
+INDEX_INTERVAL = 256
+
+CHECKSUM_CHUNK_SIZE = 1048576
+
+BATCH_SIZE = 10000
+
+PARTITION_SIZE = 16 * 1048576
+RESYNC_RECORD_COUNT = 4
+
+COMPRESSIONS = collections.OrderedDict([
+    ("gzip", (".gz", b"\x1F\x8B", gzip.open)),
+    ("xz", (".xz", b"\xFD7zXZ\x00", lzma.open)),
+    ("bzip2", (".bz2", b"BZh", bz2.open)),
+])
+COMPRESSION_QUEUE_SIZE = 4
+
+# Key of the record to keep by input index and tanks.
+MERGE_POLICIES = collections.OrderedDict([
+    ("newest", lambda index, tanks: index),
+    ("battles", lambda index, tanks: (sum(tank.battles for tank in tanks), index)),
+])
+
+NON_ZERO_BYTE = re.compile(b"[^\x00]")
+
+RECORD_MARKER = 0x3E  # ">"
+MAX_TANK_COUNT = 2048
+MAX_ACCOUNT_ID = 2 ** 32
+
 
 # Entry point.
 # ------------------------------------------------------------------------------
@@ -53,6 +144,23 @@ def main(log_file):
     )
 
 
+class DumpFile(click.File):
+    """
+    Binary file parameter. Input compressed with gzip, xz or bzip2 is detected by magic bytes.
+    Output is compressed according to the file extension.
+    """
+
+    def __init__(self, mode: str):
+        super().__init__(mode, lazy=False)
+
+    def convert(self, value, param, ctx):
+        raw = super().convert(value, param, ctx)
+        fp = wrap_compressed(raw, self.mode)
+        if fp is not raw and ctx is not None:
+            ctx.call_on_close(fp.close)
+        return fp
+
+
 def run_in_event_loop(func):
     """Async command decorator."""
     @wraps(func)
@@ -61,6 +169,33 @@ def run_in_event_loop(func):
     return wrapper
 
 
+def dump_writer_options(default_format: int):
+    """Adds dump format options to command. Passes make_writer(fp) instead of them."""
+    def decorator(func):
+        @click.option("--format", "format_", default=default_format, help="Format.", show_default=True, type=FORMATS)
+        @click.option("--codec", default="zlib", help="Codec.", show_default=True, type=click.Choice(list(CODECS)))
+        @click.option("--layout", default="rows", help="Layout.", show_default=True, type=click.Choice(LAYOUTS))
+        @click.option("--tank-index", help="Store dense tank indexes instead of IDs.", is_flag=True)
+        @wraps(func)
+        def wrapper(*args, format_: int, codec: str, layout: str, tank_index: bool, **kwargs):
+            make_writer = partial(make_dump_writer, format_=format_, codec=codec, layout=layout, tank_index=tank_index)
+            return func(*args, make_writer=make_writer, **kwargs)
+        return wrapper
+    return decorator
+
+
+def dump_reader_options(func):
+    """Adds dump reading options to command. Passes make_reader(fp) instead of them."""
+    @click.option("--mmap", "use_mmap", help="Memory-map the dump.", is_flag=True)
+    @click.option("--tolerant", help="Skip corrupted data.", is_flag=True)
+    @click.option("--prefetch", default=0, help="Chunks to read ahead.", metavar="<n>", type=int)
+    @wraps(func)
+    def wrapper(*args, use_mmap: bool, tolerant: bool, prefetch: int, **kwargs):
+        make_reader = partial(DumpReader, use_mmap=use_mmap, tolerant=tolerant, prefetch=prefetch)
+        return func(*args, make_reader=make_reader, **kwargs)
+    return wrapper
+
+
 # Commands.
 # ------------------------------------------------------------------------------
 
@@ -68,51 +203,151 @@ MB = 1048576.0
 
 
 @main.command()
-@click.option("--app-id", default="demo", help="Application ID.", metavar="<application ID>", show_default=True)
+@click.option(
+    "--app-id", "app_ids", default=["demo"], help="Application ID, may be repeated.",
+    metavar="<application ID>", multiple=True, show_default=True,
+)
+@click.option("--api-url", default=API_URL, help="API base URL.", metavar="<url>", show_default=True)
 @click.option("--start-id", default=1, help="Start account ID.", metavar="<account ID>", show_default=True, type=int)
 @click.option("--end-id", default=40000000, help="End account ID.", metavar="<account ID>", show_default=True, type=int)
-@click.argument("output", type=click.File("wb"))
+@click.option(
+    "--checkpoint-interval", default=300.0, help="Seconds between checkpoints, 0 to disable.",
+    metavar="<seconds>", show_default=True, type=float,
+)
+@click.option("--resume", help="Continue from the last checkpoint.", is_flag=True)
+@click.option("--shards", default=1, help="Worker processes crawling ID ranges.", metavar="<n>", type=int)
+@click.option(
+    "--rate", default=10.0, help="Initial requests per second per application ID, 0 to adapt concurrency instead.",
+    metavar="<rps>", show_default=True, type=click.FloatRange(0.0, MAX_RATE),
+)
+@click.option("--metrics-port", default=0, help="Serve Prometheus metrics on the port.", metavar="<port>", type=int)
+@click.option(
+    "--metrics-file", help="Periodically rewritten JSON metrics.", metavar="<path>",
+    type=click.Path(dir_okay=False, writable=True),
+)
+@click.option("--prior", help="Request only IDs existing in the older dump.", metavar="<dump>", type=DumpFile("rb"))
+@click.option(
+    "--sample-rate", default=0.0, help="Fraction of ID ranges requested anyway with --prior.",
+    metavar="<rate>", show_default=True, type=click.FloatRange(0.0, 1.0),
+)
+@click.option("--spill", help="Write results unordered into spill segments and merge them in the end.", is_flag=True)
+@click.option("--incremental", help="Request tanks of accounts active since the base dump only.", is_flag=True)
+@click.option("--base", help="Base dump of incremental crawl.", metavar="<dump>", type=DumpFile("rb"))
+@click.option("--since", help="Activity timestamp, base creation time by default.", metavar="<timestamp>", type=int)
+@dump_writer_options(default_format=1)
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True))
 @run_in_event_loop
-def get(app_id: str, start_id: int, end_id: int, output):
+def get(
+    app_ids: typing.List[str], api_url: str, start_id: int, end_id: int, checkpoint_interval: float, resume: bool,
+    shards: int, rate: float, metrics_port: int, metrics_file: typing.Optional[str], prior, sample_rate: float,
+    spill: bool, incremental: bool, base, since: typing.Optional[int], make_writer, output: str,
+):
     """Get account statistics dump."""
-    api = Api(app_id)
-    consumer = AccountTanksConsumer(start_id, output)
-    max_pending_count = DEFAULT_PENDING_COUNT
-    pending = set()
-    start_time = time()
-    # Main loop.
-    for account_ids in chop(range(start_id, end_id + 1), MAX_IDS_PER_REQUEST):
-        # Acquire buffer and schedule request.
-        pending.add(asyncio.ensure_future(api.account_tanks(account_ids)))
-        if len(pending) < max_pending_count:
-            continue
-        # Wait for the request completion.
-        if len(consumer.buffer) < MAX_BUFFER_SIZE:
-            done, pending = yield from asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if resume and shards > 1:
+        raise click.ClickException("sharded crawl can't be resumed")
+    if spill and (resume or shards > 1):
+        raise click.ClickException("spill mode can't be resumed or sharded")
+    if incremental and (base is None or resume or prior is not None):
+        raise click.ClickException("incremental crawl needs --base and can't be resumed or use --prior")
+    directory = os.path.dirname(os.path.abspath(output)) if output != "-" else None
+    if prior is not None:
+        logging.info("Reading prior dump.")
+        bitmap = ExistenceBitmap.from_records(DumpReader(prior))
+        selector = AccountIdSelector(bitmap, sample_rate)
+        logging.info("Prior accounts: %d. Last existing ID: %s.", len(bitmap), selector.last_existing_id)
+    else:
+        selector = None
+    metrics = CrawlMetrics()
+    if incremental:
+        api = Api(app_ids, rate, api_url, metrics)
+        selector = yield from select_active_accounts(api, base, start_id, end_id, since)
+        api.close()
+    if resume:
+        checkpoint = CrawlCheckpoint.load(output)
+        if checkpoint is None:
+            raise click.ClickException("checkpoint is not found")
+        if (checkpoint.selector_state is not None) != (selector is not None):
+            raise click.ClickException("--prior must be used if and only if the resumed crawl used it")
+        if selector is not None:
+            selector.restore(checkpoint.selector_state)
+        if checkpoint.end_id is not None and checkpoint.end_id != end_id:
+            logging.warning("End ID #%d of the resumed crawl is used instead of #%d.", checkpoint.end_id, end_id)
+            end_id = checkpoint.end_id
+        logging.info("Resuming from #%d at offset %d.", checkpoint.expected_id, checkpoint.offset)
+        raw = fp = open(output, "r+b")
+        consumer = AccountTanksConsumer.from_checkpoint(checkpoint, resume_dump_writer(fp, checkpoint), selector)
+        start_id = checkpoint.expected_id
+    else:
+        CrawlCheckpoint.remove(output)
+        raw = click.open_file(output, "wb")
+        fp = wrap_compressed(raw, "wb")
+        writer = make_writer(fp, metadata={"start_id": start_id, "end_id": end_id})
+        if incremental:
+            writer = IncrementalWriter(writer, DumpReader(base))
+        if spill:
+            spill_directory = tempfile.TemporaryDirectory(prefix=".spill-", dir=directory)
+            consumer = SpillingConsumer(start_id, writer, spill_directory.name, selector)
         else:
-            logging.warning("Maximum buffer size is reached.")
-            done, pending = yield from asyncio.wait(pending, return_when=asyncio.ALL_COMPLETED)
-        # Process results.
-        consumer.consume_all(done)
-        # Adapt concurrent request count.
-        max_pending_count = adapt_max_pending_count(api, max_pending_count)
+            consumer = AccountTanksConsumer(start_id, writer, selector)
+    if checkpoint_interval and (output == "-" or fp is not raw or shards > 1 or spill or incremental):
+        logging.warning("Checkpoints are only supported for uncompressed dump files in the default mode.")
+        checkpoint_interval = 0.0
+    if (metrics_port or metrics_file) and shards > 1:
+        logging.warning("Metrics are not collected in sharded crawl.")
+        metrics_port, metrics_file = 0, None
+    if metrics_port:
+        server = yield from serve_metrics(metrics, metrics_port)
+    start_time = checkpoint_time = metrics_time = time()
+
+    def on_progress(max_pending_count: int):
+        nonlocal checkpoint_time, metrics_time
+        # Update metrics.
+        if metrics_port or metrics_file:
+            metrics.update(consumer, max_pending_count, consumer.writer.offset, api.key_pool.rate)
+        if metrics_file and time() - metrics_time >= METRICS_INTERVAL:
+            metrics.write_json(metrics_file)
+            metrics_time = time()
         # Print runtime statistics.
         aps = (consumer.expected_id - start_id) / (time() - start_time)
         logging.info(
-            "#%d (%d) buffer: %d | tanks: %d | aps: %.1f | apd: %.0f",
+            "#%d (%d) buffer: %d | tanks: %d | aps: %.1f | apd: %.0f | rps: %s",
             consumer.expected_id, consumer.account_count, len(consumer.buffer), consumer.tank_count, aps, aps * 86400.0,
+            api.format_rate(),
         )
-    # Let the last pending tasks finish.
-    logging.info("Finishing.")
-    if pending:
-        done, _ = yield from asyncio.wait(pending)
-        consumer.consume_all(done)
-    api.close()
-    assert not consumer.buffer, "there are buffered results left"
+        # Save checkpoint.
+        if checkpoint_interval and time() - checkpoint_time >= checkpoint_interval:
+            consumer.checkpoint(fp, end_id).write(output)
+            checkpoint_time = time()
+            logging.info("Checkpoint is saved.")
+
+    if shards > 1:
+        with tempfile.TemporaryDirectory(prefix=".shards-", dir=directory) as shard_directory:
+            crawl_shards(app_ids, api_url, start_id, end_id, shards, rate, shard_directory, consumer, selector)
+    else:
+        api = Api(app_ids, rate, api_url, metrics)
+        yield from crawl(api, consumer, start_id, end_id, on_progress, selector)
+        api.close()
+        if spill:
+            logging.info("Merging %d spill segments.", len(consumer.paths))
+            consumer.merge()
+            spill_directory.cleanup()
+        consumer.writer.close()
+        assert not consumer.buffer, "there are buffered results left"
+    if metrics_port:
+        server.close()
+    size = consumer.writer.offset
+    if metrics_file:
+        metrics.update(consumer, 0, size, None)
+        metrics.write_json(metrics_file)
+    fp.close()
+    raw.close()
+    CrawlCheckpoint.remove(output)
     # Print total statistics.
     logging.info("Finished in %s.", timedelta(seconds=time() - start_time))
-    logging.info("Dump size: %.1fMiB.", output.tell() / MB)
+    logging.info("Dump size: %.1fMiB.", size / MB)
     logging.info("Last existing ID: %s.", consumer.last_existing_id)
+    if incremental:
+        logging.info("Accounts copied from the base: %d.", consumer.writer.copied_count)
     if not consumer.account_count:
         return
     logging.info(
@@ -121,27 +356,32 @@ def get(app_id: str, start_id: int, end_id: int, output):
     )
     logging.info(
         "%.0fB per account. %.1fB per tank.",
-        output.tell() / consumer.account_count, output.tell() / consumer.tank_count,
+        size / consumer.account_count, size / consumer.tank_count,
     )
 
 
 @main.command()
-@click.argument("input_", type=click.File("rb"))
-def cat(input_):
+@dump_reader_options
+@click.option("-j", "--jobs", default=1, help="Worker processes.", metavar="<n>", type=int)
+@click.argument("input_", type=DumpFile("rb"))
+def cat(make_reader, jobs: int, input_):
     """Print dump contents."""
-    while True:
-        stats = read_account_stats(input_)
-        if not stats:
-            break  # end of file
-        account_id, tanks = stats
+    if jobs > 1:
+        partitions = make_partitions(input_, jobs)
+        for text in map_partitions(format_partition, input_.name, partitions, jobs, make_reader):
+            sys.stdout.write(text)
+        return
+    for account_id, tanks in make_reader(input_):
         for tank in tanks:
             print(account_id, *tank)
 
 
 @main.command("csv")
-@click.argument("input_", type=click.File("rb"))
+@dump_reader_options
+@click.option("-j", "--jobs", default=1, help="Worker processes.", metavar="<n>", type=int)
+@click.argument("input_", type=DumpFile("rb"))
 @click.argument("output", type=click.File("wt", encoding="utf-8"))
-def to_csv(input_: typing.io.BinaryIO, output: typing.io.TextIO):
+def to_csv(make_reader, jobs: int, input_: typing.io.BinaryIO, output: typing.io.TextIO):
     """Convert dump to CSV."""
     all_tanks = sorted(encyclopedia.TANKS.items())
 
@@ -151,57 +391,234 @@ def to_csv(input_: typing.io.BinaryIO, output: typing.io.TextIO):
         for _, tank in all_tanks
     )))
 
-    while True:
-        stats = read_account_stats(input_)
-        if not stats:
-            break  # end of file
-        account_id, tanks = stats
-        account_tanks = {tank.tank_id: tank for tank in tanks}
-        writer.writerow(itertools.chain([account_id], *(
-            [account_tanks[tank_id].battles, account_tanks[tank_id].wins]
-            if tank_id in account_tanks
-            else ["", ""]
-            for tank_id, _ in all_tanks
-        )))
+    if jobs > 1:
+        partitions = make_partitions(input_, jobs)
+        for text in map_partitions(format_csv_partition, input_.name, partitions, jobs, make_reader):
+            output.write(text)
+        return
+    write_csv_rows(make_reader(input_), writer, all_tanks)
 
 
 @main.command()
-@click.argument("old", type=click.File("rb"))
-@click.argument("new", type=click.File("rb"))
-@click.argument("output", type=click.File("wb"))
-def diff(old, new, output):
+@dump_reader_options
+@click.option("-j", "--jobs", default=1, help="Worker processes.", metavar="<n>", type=int)
+@dump_writer_options(default_format=1)
+@click.argument("old", type=DumpFile("rb"))
+@click.argument("new", type=DumpFile("rb"))
+@click.argument("output", type=DumpFile("wb"))
+def diff(make_reader, jobs: int, make_writer, old, new, output):
     """Make difference dump of two dumps."""
-    new.seek(0, os.SEEK_END)
-    new_size = new.tell() / MB
-    new.seek(0, os.SEEK_SET)
-
-    old_stats, new_stats = enumerate_tanks(old), enumerate_tanks(new)
-    diff_stats = enumerate_diff(old_stats, new_stats)
+    # Size of compressed dump is unknown until it's read.
+    new_size = os.fstat(new.fileno()).st_size / MB if not hasattr(new, "compression") else float("nan")
 
     account_count = tank_count = 0
     start_time = time()
 
-    for i, (account_id, tanks) in enumerate(itertools.groupby(diff_stats, attrgetter("account_id"))):
-        if i % 100 == 0:
-            new_position = new.tell() / MB
+    if jobs > 1:
+        partitions = make_partitions(new, jobs)
+        writer = make_writer(output, metadata=get_metadata(DumpReader(new).header))
+        results = map_partitions(diff_partition, new.name, partitions, jobs, old.name, make_reader)
+        for i, (partition, groups) in enumerate(zip(partitions, results), 1):
+            for account_id, tanks in groups:
+                tank_count += writer.write(account_id, tanks)
+                account_count += 1
+            new_position = partition.end / MB
             speed = new_position * 60.0 / (time() - start_time)
             logging.info(
-                "#%d | old: %.1fMiB | new: %.1fMiB | acc: %d | tanks: %d | %.1f MiB/min | eta: %.1f min",
-                i, old.tell() / MB, new_position, account_count, tank_count, speed, (new_size - new_position) / speed,
+                "#%d/%d | new: %.1fMiB | acc: %d | tanks: %d | %.1f MiB/min | eta: %.1f min",
+                i, len(partitions), new_position, account_count, tank_count, speed, (new_size - new_position) / speed,
             )
-        tank_count += write_account_stats(account_id, tanks, output)
-        account_count += 1
+    else:
+        old, new = make_reader(old), make_reader(new)
+        diff_stats = enumerate_batch_diff(old.batches(), new.batches())
+        writer = make_writer(output, metadata=get_metadata(new.header))
+        for i, (account_id, tanks) in enumerate(itertools.groupby(diff_stats, attrgetter("account_id"))):
+            if i % 100 == 0:
+                new_position = new.tell() / MB
+                speed = new_position * 60.0 / (time() - start_time)
+                logging.info(
+                    "#%d | old: %.1fMiB | new: %.1fMiB | acc: %d | tanks: %d | %.1f MiB/min | eta: %.1f min",
+                    i, old.tell() / MB, new_position, account_count, tank_count, speed,
+                    (new_size - new_position) / speed if speed else float("inf"),
+                )
+            tank_count += writer.write(account_id, tanks)
+            account_count += 1
+    writer.close()
 
     logging.info("Accounts: %d. Tanks: %d.", account_count, tank_count)
 
 
+@main.command()
+@click.option("--interval", default=INDEX_INTERVAL, help="Records per entry.", metavar="<n>", type=int)
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+def index(interval: int, dump: str):
+    """Build account offset index of dump."""
+    with open(dump, "rb") as fp:
+        reader = DumpReader(fp)
+        if reader.version != 1:
+            logging.info("Dump has its own block directory. Nothing to do.")
+            return
+        dump_index = DumpIndex.build(reader, interval, os.path.getsize(dump))
+    with open(dump + DumpIndex.EXTENSION, "wb") as fp:
+        dump_index.write(fp)
+    logging.info("Index entries: %d.", len(dump_index.account_ids))
+
+
+@main.command()
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+@click.argument("account_ids", nargs=-1, type=int)
+def lookup(dump: str, account_ids: typing.List[int]):
+    """Print stats of the specified accounts."""
+    dump_index = DumpIndex.load(dump)
+    with open(dump, "rb") as fp:
+        if dump_index is None and DumpReader(fp).version == 1:
+            logging.warning("Index is not found. Run `kit.py index` to speed up lookups.")
+        for account_id in account_ids:
+            tanks = find_account_stats(fp, account_id, dump_index)
+            if tanks is None:
+                logging.warning("Account #%d is not found.", account_id)
+                continue
+            for tank in tanks:
+                print(account_id, *tank)
+
+
+@main.command()
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+def checksum(dump: str):
+    """Build CRC32 checksum sidecar of dump."""
+    with open(dump, "rb") as fp:
+        checksums = DumpChecksums.build(fp, CHECKSUM_CHUNK_SIZE)
+    with open(dump + DumpChecksums.EXTENSION, "wb") as fp:
+        checksums.write(fp)
+    logging.info("Checksums: %d.", len(checksums.crcs))
+
+
+@main.command()
+@click.option("-j", "--jobs", default=os.cpu_count(), help="Worker processes.", metavar="<n>", type=int)
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+def verify(jobs: int, dump: str):
+    """Check dump integrity."""
+    start_time = time()
+    with open(dump, "rb") as fp:
+        reader = DumpReader(fp)
+        size = fp.seek(0, os.SEEK_END)
+        if reader.version == 2 and reader.checksum:
+            try:
+                footer = reader.read_footer()
+            except ValueError:
+                # The dump is truncated, so blocks are checked one by one.
+                bad_offset = verify_frames(dump)
+                if bad_offset is not None:
+                    raise click.ClickException("corrupted data at offset %d" % bad_offset)
+                raise click.ClickException("block directory is not found")
+            if footer["size"] != size:
+                raise click.ClickException("dump size is %d instead of %d" % (size, footer["size"]))
+            _, offsets = reader.read_directory()
+            tasks = [(verify_blocks, dump, offsets) for offsets in chop(offsets, 64)]
+        else:
+            checksums = DumpChecksums.load(dump)
+            if checksums is None:
+                raise click.ClickException("checksums are not found, run `kit.py checksum` on a good copy")
+            if checksums.size != size:
+                raise click.ClickException("dump size is %d instead of %d" % (size, checksums.size))
+            tasks = [
+                (verify_chunks, dump, checksums.chunk_size, chunks)
+                for chunks in chop(enumerate(checksums.crcs), 64)
+            ]
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(*task) for task in tasks]
+        for future in futures:
+            bad_offset = future.result()
+            if bad_offset is not None:
+                for other_future in futures:
+                    other_future.cancel()
+                raise click.ClickException("corrupted data at offset %d" % bad_offset)
+    logging.info("Dump is OK. Checked in %s.", timedelta(seconds=time() - start_time))
+
+
+@main.command()
+@dump_writer_options(default_format=2)
+@click.argument("input_", type=DumpFile("rb"))
+@click.argument("output", type=DumpFile("wb"))
+def convert(make_writer, input_, output):
+    """Convert dump to another format."""
+    reader = DumpReader(input_)
+    writer = make_writer(output, metadata=get_metadata(reader.header))
+    for account_id, tanks in reader:
+        writer.write(account_id, tanks)
+    writer.close()
+    logging.info("Dump size: %.1fMiB.", output.tell() / MB)
+
+
+@main.command()
+@dump_reader_options
+@dump_writer_options(default_format=2)
+@click.option(
+    "--policy", default="newest", help="Duplicate account policy: newest input wins or more battles wins.",
+    show_default=True, type=click.Choice(list(MERGE_POLICIES)),
+)
+@click.option(
+    "--buffer-size", default=16, help="I/O buffer size per input.", metavar="<MiB>", show_default=True, type=int,
+)
+@click.argument("output", type=DumpFile("wb"))
+@click.argument("inputs", nargs=-1, required=True, type=DumpFile("rb"))
+def merge(make_reader, make_writer, policy: str, buffer_size: int, output, inputs):
+    """Merge sorted dumps. Later inputs are considered newer."""
+    start_time = time()
+    readers = [
+        make_reader(io.BufferedReader(input_, buffer_size * 1048576), block_size=MERGE_BLOCK_SIZE)
+        for input_ in inputs
+    ]
+    metadata = {}
+    for reader in readers:
+        header = get_metadata(reader.header)
+        if "start_id" in header:
+            metadata["start_id"] = min(metadata.get("start_id", header["start_id"]), header["start_id"])
+        if "end_id" in header:
+            metadata["end_id"] = max(metadata.get("end_id", header["end_id"]), header["end_id"])
+    writer = make_writer(output, metadata=metadata)
+    account_count = duplicate_count = 0
+    for account_id, tanks, candidate_count in merge_records(readers, MERGE_POLICIES[policy]):
+        writer.write(account_id, tanks)
+        account_count += 1
+        duplicate_count += candidate_count - 1
+    writer.close()
+    logging.info("Merged in %s.", timedelta(seconds=time() - start_time))
+    logging.info("Accounts: %d. Duplicates: %d.", account_count, duplicate_count)
+    logging.info("Dump size: %.1fMiB.", output.tell() / MB)
+
+
+@main.command()
+@click.argument("dump", type=click.File("rb"))
+def info(dump):
+    """Print dump header and summary."""
+    reader = DumpReader(dump)
+    print("version:", reader.version)
+    if reader.version == 1:
+        print("size:", dump.seek(0, os.SEEK_END))
+        return  # there is neither header nor footer
+    try:
+        _, block_count = reader.read_tail()
+        footer = reader.read_footer()
+    except ValueError as e:
+        raise click.ClickException("%s, the dump is truncated or not finished" % e)
+    print("block_count:", block_count)
+    # The footer tank table supersedes the initial one.
+    for key, value in sorted(dict(reader.header, **footer).items()):
+        if key == "tank_ids":
+            key, value = "tank_id_count", len(value)
+        if key != "version":
+            print("%s: %s" % (key, value))
+
+
 @main.command()
 @click.option("--app-id", default="demo", help="Application ID.", metavar="<application ID>", show_default=True)
+@click.option("--api-url", default=API_URL, help="API base URL.", metavar="<url>", show_default=True)
 @click.argument("output", type=click.File("wt", encoding="utf-8"))
 @run_in_event_loop
-def renew(app_id, output):
+def renew(app_id, api_url, output):
     """Get encyclopedia.py."""
-    api = Api(app_id)
+    api = Api(app_id, url=api_url)
     # Get tank list.
     logging.info("Getting tank list.")
     tanks = dict((yield from api.encyclopedia_tanks(fields="tank_id")))
@@ -276,9 +693,15 @@ def renew(app_id, output):
 class Api:
     """Wargaming Public API interface."""
 
-    def __init__(self, app_id: str):
-        self.app_id = app_id
+    def __init__(
+        self, app_ids: typing.Union[str, typing.List[str]], rate=0.0, url=API_URL, metrics: "CrawlMetrics" = None,
+    ):
+        if isinstance(app_ids, str):
+            app_ids = [app_ids]
+        self.url = url
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
         self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector())
+        self.key_pool = KeyPool([ApiKey(app_id, make_rate_controller(rate)) for app_id in app_ids])
         self.reset_error_rate()
 
     def reset_error_rate(self):
@@ -298,6 +721,16 @@ class Api:
             for account_id, tanks in data.items()
         ]
 
+    @asyncio.coroutine
+    def account_info(self, account_ids, fields: str):
+        """Gets account info."""
+        data = yield from self.make_request(
+            "account/info",
+            account_id=self.make_comma_separated_list(account_ids),
+            fields=fields,
+        )
+        return [(int(account_id), info) for account_id, info in data.items()]
+
     @asyncio.coroutine
     def encyclopedia_tanks(self, **kwargs):
         """
@@ -322,14 +755,15 @@ class Api:
 
     @asyncio.coroutine
     def make_request(self, method: str, **kwargs):
-        """Makes API request."""
-        params = dict(kwargs, application_id=self.app_id)
-        backoff = exponential_backoff(0.1, 600.0, 2.0, 0.1)
-        for sleep_time in backoff:
+        """Makes API request. Failed requests are retried with the key which is available first."""
+        for retry_count in itertools.count():
+            key = yield from self.key_pool.acquire()
+            params = dict(kwargs, application_id=key.app_id)
+            request_time = time()
             try:
                 response = yield from asyncio.wait_for(self.session.request(
                     "GET",
-                    "http://api.worldoftanks.ru/wot/%s/" % method,
+                    "%s/%s/" % (self.url, method),
                     params=params,
                 ), 10.0)
             except asyncio.TimeoutError:
@@ -338,21 +772,32 @@ class Api:
             except aiohttp.errors.ClientError:
                 logging.warning("Client error.")
                 response = None
+            self.metrics.requests.inc()
+            self.metrics.request_duration.observe(time() - request_time)
             if response is None:
-                pass  # do nothing
+                key.on_error()
             elif response.status == http.client.OK:
                 self.request_count += 1
                 json = yield from response.json()
                 if json["status"] == "ok":
+                    key.on_success(time() - request_time)
+                    self.metrics.request_retries.observe(retry_count)
                     return json["data"]
                 if json["error"]["message"] == "REQUEST_LIMIT_EXCEEDED":
                     self.request_limit_exceeded_count += 1
+                    self.metrics.request_limit_exceeded.inc()
                 print(json)
                 logging.warning("API error: %s", json["error"]["message"])
+                key.on_error()
             else:
-                logging.error("HTTP status: %d", response.status_code)
-            logging.warning("sleep %.1fs", sleep_time)
-            yield from asyncio.sleep(sleep_time)
+                logging.error("HTTP status: %d", response.status)
+                key.on_error()
+            self.metrics.errors.inc()
+
+    def format_rate(self) -> str:
+        """Gets the current request rate for logging."""
+        rate = self.key_pool.rate
+        return "%.1f" % rate if rate is not None else "-"
 
     @staticmethod
     def make_comma_separated_list(items) -> str:
@@ -366,20 +811,738 @@ class Api:
         self.session.close()
 
 
+# Rate control.
+# ------------------------------------------------------------------------------
+
+class TokenBucket:
+    """Limits the event rate. Saves unused tokens up to the capacity."""
+
+    def __init__(self, rate: float, capacity=1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = time()
+
+    def refill(self):
+        now = time()
+        self.tokens = min(self.tokens + (now - self.timestamp) * self.rate, self.capacity)
+        self.timestamp = now
+
+    def wait_time(self) -> float:
+        """Gets seconds until a token is available."""
+        self.refill()
+        return max(1.0 - self.tokens, 0.0) / self.rate
+
+    def take(self):
+        """Takes an available token."""
+        self.tokens -= 1.0
+
+
+class AimdRateController:
+    """
+    Additive increase, multiplicative decrease of the request rate.
+    The rate grows by RATE_INCREASE per second of successful requests.
+    Errors and slow responses multiply it by RATE_DECREASE at most once per RATE_DECREASE_COOLDOWN.
+    """
+
+    def __init__(self, rate: float, min_rate=MIN_RATE, max_rate=MAX_RATE):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.bucket = TokenBucket(min(max(rate, min_rate), max_rate))
+        self.decrease_time = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def on_success(self, response_time: float):
+        if response_time >= SLOW_RESPONSE_TIME:
+            self.decrease()
+        else:
+            self.set_rate(self.rate + RATE_INCREASE / self.rate)
+
+    def on_error(self):
+        self.decrease()
+
+    def decrease(self):
+        if time() - self.decrease_time >= RATE_DECREASE_COOLDOWN:
+            self.set_rate(self.rate * RATE_DECREASE)
+            self.decrease_time = time()
+
+    def set_rate(self, rate: float):
+        self.bucket.refill()
+        self.bucket.rate = min(max(rate, self.min_rate), self.max_rate)
+
+
+def make_rate_controller(rate: float) -> typing.Optional[AimdRateController]:
+    """Makes the rate controller unless rate is zero."""
+    return AimdRateController(rate) if rate else None
+
+
+class ApiKey:
+    """
+    Application ID with its own request rate and failure state.
+    Every failure backs the key off exponentially. Too many failures in a row sideline it.
+    """
+
+    def __init__(self, app_id: str, rate_controller: AimdRateController = None):
+        self.app_id = app_id
+        self.rate_controller = rate_controller
+        self.failure_count = 0
+        self.sidelined_until = 0.0
+        self.backoff = None
+        self.backoff_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Gets seconds until the key may be used."""
+        wait_time = max(self.sidelined_until - now, self.backoff_until - now, 0.0)
+        if self.rate_controller is not None:
+            wait_time = max(self.rate_controller.bucket.wait_time(), wait_time)
+        return wait_time
+
+    def on_success(self, response_time: float):
+        self.failure_count = 0
+        self.backoff = None
+        if self.rate_controller is not None:
+            self.rate_controller.on_success(response_time)
+
+    def on_error(self):
+        if self.rate_controller is not None:
+            self.rate_controller.on_error()
+        if self.backoff is None:
+            self.backoff = exponential_backoff(0.1, 600.0, 2.0, 0.1)
+        sleep_time = next(self.backoff)
+        logging.warning("Application ID %s backs off for %.1fs.", self.app_id, sleep_time)
+        self.backoff_until = time() + sleep_time
+        self.failure_count += 1
+        if self.failure_count >= KEY_FAILURE_LIMIT:
+            logging.warning("Application ID %s is sidelined for %.0fs.", self.app_id, KEY_SIDELINE_TIME)
+            self.sidelined_until = time() + KEY_SIDELINE_TIME
+            self.failure_count = 0
+            self.backoff, self.backoff_until = None, 0.0
+
+
+class KeyPool:
+    """Spreads requests across application IDs."""
+
+    def __init__(self, keys: typing.List[ApiKey]):
+        self.keys = keys
+        self.index = 0
+
+    @property
+    def rate(self) -> typing.Optional[float]:
+        """Gets the total request rate if it's controlled."""
+        rates = [key.rate_controller.rate for key in self.keys if key.rate_controller is not None]
+        return sum(rates) if rates else None
+
+    @asyncio.coroutine
+    def acquire(self) -> ApiKey:
+        """Waits for the key which is available first."""
+        while True:
+            now = time()
+            # Rotate the keys so that equally available ones are used in turn.
+            self.index = (self.index + 1) % len(self.keys)
+            wait_time, _, key = min(
+                (key.wait_time(now), index, key)
+                for index, key in enumerate(self.keys[self.index:] + self.keys[:self.index])
+            )
+            if not wait_time:
+                break
+            yield from asyncio.sleep(wait_time)
+        if key.rate_controller is not None:
+            key.rate_controller.bucket.take()
+        return key
+
+
+# Metrics.
+# ------------------------------------------------------------------------------
+
+class Gauge:
+    """Metric that can go up and down."""
+
+    type_ = "gauge"
+
+    def __init__(self, name: str, help_: str):
+        self.name = name
+        self.help = help_
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, value=1):
+        self.value += value
+
+    def format_prometheus(self) -> typing.List[str]:
+        return self.format_header() + ["%s %s" % (self.name, self.value)]
+
+    def format_header(self) -> typing.List[str]:
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type_)]
+
+    def to_json(self):
+        return self.value
+
+
+class Counter(Gauge):
+    """Metric that only goes up."""
+
+    type_ = "counter"
+
+
+class Histogram(Gauge):
+    """Counts observed values in cumulative buckets by upper bound."""
+
+    type_ = "histogram"
+
+    def __init__(self, name: str, help_: str, buckets):
+        super().__init__(name, help_)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_cumulative_counts(self) -> typing.List[typing.Tuple[str, int]]:
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return list(zip(bounds, itertools.accumulate(self.counts)))
+
+    def format_prometheus(self) -> typing.List[str]:
+        return self.format_header() + [
+            "%s_bucket{le=\"%s\"} %d" % (self.name, bound, count) for bound, count in self.get_cumulative_counts()
+        ] + [
+            "%s_sum %s" % (self.name, self.sum),
+            "%s_count %d" % (self.name, self.count),
+        ]
+
+    def to_json(self) -> dict:
+        return {"buckets": collections.OrderedDict(self.get_cumulative_counts()), "sum": self.sum, "count": self.count}
+
+
+class CrawlMetrics:
+    """Crawl performance metrics."""
+
+    def __init__(self):
+        self.metrics = []
+        # API requests.
+        self.requests = self.add(Counter("kit_requests_total", "API request attempts."))
+        self.errors = self.add(Counter("kit_request_errors_total", "Failed API request attempts."))
+        self.request_limit_exceeded = self.add(Counter(
+            "kit_request_limit_exceeded_total", "REQUEST_LIMIT_EXCEEDED API errors."))
+        self.request_duration = self.add(Histogram(
+            "kit_request_duration_seconds", "API request attempt latency.", LATENCY_BUCKETS))
+        self.request_retries = self.add(Histogram(
+            "kit_request_retries", "Retries of succeeded API requests.", RETRY_BUCKETS))
+        self.hedged_requests = self.add(Counter(
+            "kit_hedged_requests_total", "Duplicated requests blocking the written account ID."))
+        self.request_rate = self.add(Gauge("kit_request_rate", "Allowed API requests per second."))
+        self.max_pending_count = self.add(Gauge("kit_max_pending_count", "Maximum concurrent API requests."))
+        # Consumer.
+        self.buffer_size = self.add(Gauge("kit_buffer_size", "Buffered accounts waiting for earlier ones."))
+        self.expected_id = self.add(Gauge("kit_expected_id", "Next account ID to be written."))
+        self.accounts = self.add(Gauge("kit_accounts", "Written accounts."))
+        self.tanks = self.add(Gauge("kit_tanks", "Written tanks."))
+        self.written_bytes = self.add(Gauge("kit_written_bytes", "Written dump bytes."))
+        self.progress_time = self.add(Gauge(
+            "kit_progress_timestamp_seconds", "Last time when the expected account ID advanced."))
+
+    def add(self, metric: Gauge) -> Gauge:
+        self.metrics.append(metric)
+        return metric
+
+    def update(self, consumer: "AccountTanksConsumer", max_pending_count: int, written_bytes: int, rate=None):
+        """Updates the gauges."""
+        if consumer.expected_id != self.expected_id.value:
+            self.progress_time.set(time())
+        self.expected_id.set(consumer.expected_id)
+        self.accounts.set(consumer.account_count)
+        self.tanks.set(consumer.tank_count)
+        self.buffer_size.set(len(consumer.buffer))
+        self.max_pending_count.set(max_pending_count)
+        self.written_bytes.set(written_bytes)
+        self.request_rate.set(rate or 0.0)
+
+    def format_prometheus(self) -> str:
+        """Formats metrics in Prometheus text format."""
+        return "".join(line + "\n" for metric in self.metrics for line in metric.format_prometheus())
+
+    def to_json(self) -> dict:
+        return {metric.name: metric.to_json() for metric in self.metrics}
+
+    def write_json(self, path: str):
+        """Rewrites the file atomically."""
+        with open(path + ".tmp", "wt", encoding="utf-8") as fp:
+            json.dump(self.to_json(), fp, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+
+@asyncio.coroutine
+def serve_metrics(metrics: CrawlMetrics, port: int, host="127.0.0.1"):
+    """Starts HTTP server exposing Prometheus metrics. Returns the server."""
+    @asyncio.coroutine
+    def handle(request):
+        return web.Response(text=metrics.format_prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_route("GET", "/metrics", handle)
+    logging.info("Serving metrics on http://%s:%d/metrics.", host, port)
+    return (yield from asyncio.get_event_loop().create_server(app.make_handler(), host, port))
+
+
+# Crawling.
+# ------------------------------------------------------------------------------
+
+@asyncio.coroutine
+def crawl(api: Api, consumer: "AccountTanksConsumer", start_id: int, end_id: int, on_progress, selector=None):
+    """
+    Requests account tanks of the ID range and feeds the consumer.
+    Calls on_progress(max_pending_count) after every consumption.
+    Only IDs chosen by the selector are requested if it is given.
+    """
+    max_pending_count = get_initial_pending_count(api)
+    pending = HedgedRequests(api)
+    if selector is not None:
+        all_account_ids = select_account_ids(start_id, end_id, selector)
+    else:
+        all_account_ids = range(start_id, end_id + 1)
+    # Main loop.
+    for account_ids in chop(all_account_ids, MAX_IDS_PER_REQUEST):
+        # Acquire buffer and schedule request.
+        pending.schedule(account_ids)
+        if len(pending) < max_pending_count:
+            continue
+        # Wait for the request completion and process results.
+        if len(consumer.buffer) < MAX_BUFFER_SIZE:
+            consumer.consume_all((yield from pending.wait(consumer.expected_id)))
+        else:
+            logging.warning("Maximum buffer size is reached.")
+            yield from pending.wait_all(consumer)
+        # Adapt concurrent request count unless the rate is controlled.
+        if api.key_pool.rate is None:
+            max_pending_count = adapt_max_pending_count(api, max_pending_count)
+        on_progress(max_pending_count)
+    # Let the last pending tasks finish.
+    logging.info("Finishing.")
+    yield from pending.wait_all(consumer)
+
+
+def get_initial_pending_count(api: Api) -> int:
+    """Gets maximum pending request count to start with."""
+    if api.key_pool.rate is None:
+        return DEFAULT_PENDING_COUNT
+    return MAX_PENDING_COUNT * len(api.key_pool.keys)
+
+
+class PendingRequest:
+    """Scheduled account/tanks request and its duplicate if any."""
+
+    __slots__ = ("account_ids", "start_time", "twin")
+
+    def __init__(self, account_ids, start_time: float, twin: asyncio.Future = None):
+        self.account_ids = account_ids
+        self.start_time = start_time
+        self.twin = twin
+
+
+class HedgedRequests:
+    """
+    Pending account/tanks requests.
+    The request blocking the consumer is duplicated once it is older than HEDGE_PERCENTILE of recent durations.
+    The first answer is used and the other request is cancelled.
+    """
+
+    def __init__(self, api: Api):
+        self.api = api
+        self.requests = {}
+        self.durations = collections.deque(maxlen=HEDGE_WINDOW)
+
+    def __len__(self) -> int:
+        return len(self.requests)
+
+    def schedule(self, account_ids, twin: asyncio.Future = None) -> asyncio.Future:
+        task = asyncio.ensure_future(self.api.account_tanks(account_ids))
+        self.requests[task] = PendingRequest(account_ids, time(), twin)
+        return task
+
+    @asyncio.coroutine
+    def wait(self, expected_id: int) -> list:
+        """Waits for the first completed requests. Hedges the blocking request meanwhile."""
+        while True:
+            blocking_task = self.find_blocking_task(expected_id)
+            timeout = self.get_hedge_timeout(blocking_task) if blocking_task is not None else None
+            done, _ = yield from asyncio.wait(list(self.requests), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if done:
+                return self.pop_done(done)
+            logging.info("Hedging request of #%d.", expected_id)
+            self.api.metrics.hedged_requests.inc()
+            self.requests[blocking_task].twin = self.schedule(self.requests[blocking_task].account_ids, blocking_task)
+
+    @asyncio.coroutine
+    def wait_all(self, consumer: "AccountTanksConsumer"):
+        """Waits for all the requests. Results are consumed as they arrive so that hedging keeps working."""
+        while self.requests:
+            consumer.consume_all((yield from self.wait(consumer.expected_id)))
+
+    def find_blocking_task(self, expected_id: int) -> typing.Optional[asyncio.Future]:
+        """Finds the request for the expected ID unless it's already duplicated."""
+        for task, request in self.requests.items():
+            if request.twin is None and request.account_ids[0] <= expected_id <= request.account_ids[-1]:
+                return task
+        return None
+
+    def get_hedge_timeout(self, task: asyncio.Future) -> typing.Optional[float]:
+        """Gets seconds until the request should be duplicated."""
+        if len(self.durations) < HEDGE_MIN_SAMPLES:
+            return None
+        threshold = sorted(self.durations)[int(HEDGE_PERCENTILE * (len(self.durations) - 1))]
+        return max(self.requests[task].start_time + threshold - time(), 0.0)
+
+    def pop_done(self, done) -> list:
+        """Removes completed requests and cancels their duplicates. Gets tasks to be consumed."""
+        tasks = []
+        for task in done:
+            request = self.requests.pop(task, None)
+            if request is None:
+                continue  # the duplicate is already consumed
+            if request.twin is not None:
+                request.twin.cancel()
+                self.requests.pop(request.twin, None)
+            self.durations.append(time() - request.start_time)
+            tasks.append(task)
+        return tasks
+
+
+def split_id_range(start_id: int, end_id: int, count: int) -> typing.List[typing.Tuple[int, int]]:
+    """Splits the inclusive ID range into contiguous inclusive ranges of nearly equal size."""
+    id_count = end_id - start_id + 1
+    bounds = [start_id + id_count * i // count for i in range(count + 1)]
+    return [(bounds[i], bounds[i + 1] - 1) for i in range(count)]
+
+
+def crawl_shard(
+    app_ids: typing.List[str], api_url: str, start_id: int, end_id: int, rate: float, path: str, progress,
+    selector=None, keep_empty=False,
+) -> typing.Tuple[int, int, int]:
+    """
+    Crawls the ID range into version 1 dump in a worker process. Optionally keeps requested accounts without tanks.
+    Reports (start_id, expected_id, account_count, tank_count, rate) into the progress queue.
+    Returns account count, tank count and last existing ID.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    report_time = time()
+
+    def report():
+        progress.put((
+            start_id, min(consumer.expected_id, end_id + 1), consumer.account_count, consumer.tank_count,
+            api.key_pool.rate or 0.0,
+        ))
+
+    def on_progress(max_pending_count: int):
+        nonlocal report_time
+        if time() - report_time >= 1.0:
+            report()
+            report_time = time()
+
+    with open(path, "wb") as fp:
+        consumer = AccountTanksConsumer(start_id, AccountStatsWriter(fp, keep_empty=keep_empty), selector)
+        api = Api(app_ids, rate, api_url)
+        loop.run_until_complete(crawl(api, consumer, start_id, end_id, on_progress, selector))
+        api.close()
+        consumer.writer.close()
+    loop.close()
+    assert not consumer.buffer, "there are buffered results left"
+    report()
+    return consumer.account_count, consumer.tank_count, consumer.last_existing_id
+
+
+def crawl_shards(
+    app_ids: typing.List[str], api_url: str, start_id: int, end_id: int, shards: int, rate: float, directory: str,
+    consumer, selector=None,
+):
+    """
+    Crawls contiguous ID ranges in worker processes. Logs the total progress.
+    The request rate is split between the workers since they share the same application ID.
+    Shard dumps are written into the directory and then concatenated into the consumer writer.
+    """
+    id_count = end_id - start_id + 1
+    ranges = split_id_range(start_id, end_id, shards)
+    paths = [os.path.join(directory, "%d.dump" % i) for i in range(shards)]
+    states = {shard_start_id: (shard_start_id, 0, 0, 0.0) for shard_start_id, _ in ranges}
+    start_time = log_time = time()
+    # Incremental crawl drops base stats of requested accounts without tanks.
+    keep_empty = isinstance(consumer.writer, IncrementalWriter)
+    with multiprocessing.Manager() as manager, concurrent.futures.ProcessPoolExecutor(shards) as executor:
+        progress = manager.Queue()
+        futures = [
+            executor.submit(
+                crawl_shard, app_ids, api_url, shard_start_id, shard_end_id, rate / shards, path, progress, selector,
+                keep_empty,
+            )
+            for (shard_start_id, shard_end_id), path in zip(ranges, paths)
+        ]
+        while not all(future.done() for future in futures):
+            try:
+                shard_start_id, *state = progress.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            states[shard_start_id] = state
+            if time() - log_time < 1.0:
+                continue
+            log_time = time()
+            expected_ids, account_counts, tank_counts, rates = zip(*states.values())
+            done_count = sum(expected_ids) - sum(states)
+            aps = done_count / (time() - start_time)
+            logging.info(
+                "shards: %d/%d | ids: %d/%d | acc: %d | tanks: %d | aps: %.1f | apd: %.0f | rps: %.1f",
+                sum(future.done() for future in futures), shards, done_count, id_count,
+                sum(account_counts), sum(tank_counts), aps, aps * 86400.0, sum(rates),
+            )
+        results = [future.result() for future in futures]
+    logging.info("Merging shards.")
+    writer = consumer.writer
+    for path, (account_count, tank_count, last_existing_id) in zip(paths, results):
+        with open(path, "rb") as fp:
+            if isinstance(writer, AccountStatsWriter):
+                writer.append(fp)
+            else:
+                for account_id, tanks in DumpReader(fp):
+                    if tanks:
+                        writer.write(account_id, tanks)
+                    else:
+                        writer.skip(account_id)
+        consumer.account_count += account_count
+        consumer.tank_count += tank_count
+        if last_existing_id is not None:
+            consumer.last_existing_id = last_existing_id
+        os.remove(path)
+    consumer.expected_id = end_id + 1
+    writer.close()
+
+
+class ExistenceBitmap:
+    """Compact set of account IDs."""
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    @classmethod
+    def from_records(cls, records) -> "ExistenceBitmap":
+        bitmap = cls()
+        for account_id, _ in records:
+            bitmap.add(account_id)
+        return bitmap
+
+    def add(self, account_id: int):
+        index, shift = divmod(account_id, 8)
+        if index >= len(self.bits):
+            self.bits.extend(bytes(max(index + 1 - len(self.bits), len(self.bits))))
+        if not self.bits[index] & (1 << shift):
+            self.bits[index] |= 1 << shift
+            self.count += 1
+
+    def __contains__(self, account_id: int) -> bool:
+        index, shift = divmod(account_id, 8)
+        return index < len(self.bits) and bool(self.bits[index] & (1 << shift))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def max(self) -> typing.Optional[int]:
+        """Gets the largest account ID."""
+        index = len(self.bits.rstrip(b"\x00")) - 1
+        return index * 8 + self.bits[index].bit_length() - 1 if index >= 0 else None
+
+    def next(self, account_id: int) -> typing.Optional[int]:
+        """Gets the smallest account ID not less than the given one."""
+        index, shift = divmod(account_id, 8)
+        if index >= len(self.bits):
+            return None
+        byte = self.bits[index] >> shift
+        if not byte:
+            match = NON_ZERO_BYTE.search(self.bits, index + 1)
+            if match is None:
+                return None
+            account_id, byte = match.start() * 8, self.bits[match.start()]
+        return account_id + (byte & -byte).bit_length() - 1
+
+
+class AccountIdSelector:
+    """
+    Chooses account IDs worth requesting: existing in the prior dump or newer than its last existing ID.
+    Every 1 / sample_rate range of MAX_IDS_PER_REQUEST IDs is chosen anyway to catch reactivated accounts.
+    The sampled ranges are shifted by a random phase, so that every crawl covers other ones.
+    """
+
+    def __init__(self, bitmap: ExistenceBitmap, sample_rate=0.0, last_existing_id: int = None, phase: int = None):
+        self.bitmap = bitmap
+        self.last_existing_id = last_existing_id if last_existing_id is not None else bitmap.max()
+        self.sample_period = round(1.0 / sample_rate) if sample_rate else 0
+        self.phase = phase if phase is not None or not self.sample_period else randrange(self.sample_period)
+
+    def next_id(self, account_id: int) -> int:
+        """Gets the smallest chosen ID not less than the given one."""
+        if self.last_existing_id is None or account_id > self.last_existing_id:
+            return account_id
+        candidates = [self.last_existing_id + 1]
+        if self.sample_period:
+            window = account_id // MAX_IDS_PER_REQUEST
+            skipped_count = (self.phase - window) % self.sample_period
+            if not skipped_count:
+                return account_id
+            candidates.append((window + skipped_count) * MAX_IDS_PER_REQUEST)
+        existing_id = self.bitmap.next(account_id)
+        if existing_id is not None:
+            candidates.append(existing_id)
+        return min(candidates)
+
+    def checkpoint(self) -> dict:
+        """Gets the sampling state."""
+        return {"sample_period": self.sample_period, "phase": self.phase}
+
+    def restore(self, state: dict):
+        """Continues sampling of the resumed crawl."""
+        self.sample_period, self.phase = state["sample_period"], state["phase"]
+
+
+@asyncio.coroutine
+def find_active_accounts(api: Api, account_ids, since: float) -> ExistenceBitmap:
+    """Requests last battle time of the accounts. Gets the accounts which have played since the timestamp."""
+    active = ExistenceBitmap()
+    max_pending_count = get_initial_pending_count(api)
+    pending = set()
+    log_time = time()
+
+    def add_active(tasks):
+        for task in tasks:
+            for account_id, info in task.result():
+                if info and (info["last_battle_time"] or 0) >= since:
+                    active.add(account_id)
+
+    for account_ids in chop(account_ids, MAX_IDS_PER_REQUEST):
+        pending.add(asyncio.ensure_future(api.account_info(account_ids, "last_battle_time")))
+        if len(pending) < max_pending_count:
+            continue
+        done, pending = yield from asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        add_active(done)
+        if api.key_pool.rate is None:
+            max_pending_count = adapt_max_pending_count(api, max_pending_count)
+        if time() - log_time >= METRICS_INTERVAL:
+            logging.info("#%d | active: %d | rps: %s", account_ids[-1], len(active), api.format_rate())
+            log_time = time()
+    if pending:
+        done, _ = yield from asyncio.wait(pending)
+        add_active(done)
+    return active
+
+
+@asyncio.coroutine
+def select_active_accounts(api: Api, base, start_id: int, end_id: int, since: float = None) -> AccountIdSelector:
+    """
+    Finds accounts of the base dump or newer ones which have played since the base dump was made.
+    Rewinds the base dump.
+    """
+    reader = DumpReader(base)
+    if since is None:
+        if "created" not in reader.header:
+            raise click.ClickException("base dump creation time is unknown, use --since")
+        since = datetime.strptime(reader.header["created"], "%Y-%m-%dT%H:%M:%S").timestamp()
+    logging.info("Reading base dump.")
+    bitmap = ExistenceBitmap.from_records(reader)
+    logging.info("Base accounts: %d. Checking activity since %s.", len(bitmap), datetime.fromtimestamp(since))
+    account_ids = select_account_ids(start_id, end_id, AccountIdSelector(bitmap))
+    active = yield from find_active_accounts(api, account_ids, since)
+    logging.info("Active accounts: %d.", len(active))
+    base.seek(0)
+    return AccountIdSelector(active, last_existing_id=end_id)
+
+
+class IncrementalWriter:
+    """Writes fresh account stats and copies the other ones from the base dump in account ID order."""
+
+    def __init__(self, writer, base_records):
+        self.writer = writer
+        self.base_records = iter(base_records)
+        self.base_record = safe_next(self.base_records)
+        self.copied_count = 0
+
+    def write(self, account_id: int, tanks) -> int:
+        """Writes account stats. Returns tank count."""
+        self.skip(account_id)
+        return self.writer.write(account_id, tanks)
+
+    def skip(self, account_id: int):
+        """Drops the base stats of the requested account which has no tanks now."""
+        self.copy_base(account_id)
+        if self.base_record is not None and self.base_record[0] == account_id:
+            self.base_record = safe_next(self.base_records)
+
+    @property
+    def offset(self) -> int:
+        return self.writer.offset
+
+    def copy_base(self, end_id: float):
+        """Copies base account stats with lower account IDs."""
+        while self.base_record is not None and self.base_record[0] < end_id:
+            self.writer.write(*self.base_record)
+            self.copied_count += 1
+            self.base_record = safe_next(self.base_records)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.copy_base(float("inf"))
+        self.writer.close()
+
+
+def select_account_ids(start_id: int, end_id: int, selector: AccountIdSelector):
+    """Yields chosen account IDs of the range."""
+    account_id = selector.next_id(start_id)
+    while account_id <= end_id:
+        yield account_id
+        account_id = selector.next_id(account_id + 1)
+
+
 # Buffering.
 # ------------------------------------------------------------------------------
 
 class AccountTanksConsumer:
     """Consumes results of account/tanks API requests."""
 
-    def __init__(self, start_id: int, output):
-        self.expected_id = start_id
-        self.output = output
+    def __init__(self, start_id: int, writer, selector: AccountIdSelector = None):
+        self.selector = selector
+        self.expected_id = self.next_id(start_id)
+        self.writer = writer
         self.buffer = {}
         self.account_count = 0
         self.tank_count = 0
         self.last_existing_id = None
 
+    @classmethod
+    def from_checkpoint(
+        cls, checkpoint: "CrawlCheckpoint", writer, selector: AccountIdSelector = None,
+    ) -> "AccountTanksConsumer":
+        consumer = cls(checkpoint.expected_id, writer, selector)
+        consumer.account_count = checkpoint.account_count
+        consumer.tank_count = checkpoint.tank_count
+        consumer.last_existing_id = checkpoint.last_existing_id
+        return consumer
+
+    def checkpoint(self, fp, end_id: int) -> "CrawlCheckpoint":
+        """Makes the output consistent and durable. Gets the crawl state."""
+        writer_state = self.writer.checkpoint()
+        fp.flush()
+        os.fsync(fp.fileno())
+        return CrawlCheckpoint(
+            self.expected_id, self.account_count, self.tank_count, self.last_existing_id, fp.tell(), writer_state,
+            end_id, self.selector.checkpoint() if self.selector is not None else None,
+        )
+
     def consume_all(self, tasks):
         for task in tasks:
             self.consume(task.result())
@@ -395,13 +1558,21 @@ class AccountTanksConsumer:
             tanks = self.buffer.pop(self.expected_id)
             # Write account stats.
             if tanks:
-                write_account_stats(self.expected_id, map(self.to_tank_instance, tanks), self.output)
+                self.writer.write(self.expected_id, map(self.to_tank_instance, tanks))
                 # Update stats.
                 self.account_count += 1
                 self.tank_count += len(tanks)
                 self.last_existing_id = self.expected_id
+            else:
+                self.writer.skip(self.expected_id)
             # Expect next account ID.
-            self.expected_id += 1
+            self.expected_id = self.next_id(self.expected_id + 1)
+        # Write all the records at once.
+        self.writer.flush()
+
+    def next_id(self, account_id: int) -> int:
+        """Gets the next account ID to be requested."""
+        return self.selector.next_id(account_id) if self.selector is not None else account_id
 
     @staticmethod
     def to_tank_instance(tank: dict):
@@ -409,6 +1580,102 @@ class AccountTanksConsumer:
         return Tank(tank["tank_id"], tank["statistics"]["battles"], tank["statistics"]["wins"])
 
 
+class SpillingConsumer(AccountTanksConsumer):
+    """
+    Writes results in arrival order into version 1 spill segments instead of buffering them.
+    merge() sorts the segments and merges them into the writer. Expected ID only tracks progress.
+    """
+
+    def __init__(
+        self, start_id: int, writer, directory: str, selector: AccountIdSelector = None,
+        segment_size=SPILL_SEGMENT_SIZE, merge_fan_in=SPILL_MERGE_FAN_IN,
+    ):
+        super().__init__(start_id, writer, selector)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.merge_fan_in = merge_fan_in
+        self.keep_empty = isinstance(writer, IncrementalWriter)
+        self.paths = []
+        self.segment = None
+        # Next expected ID by the first ID of a consumed request.
+        self.next_ids = {}
+
+    def consume(self, result):
+        """Writes request result into the current segment."""
+        if self.segment is None or self.segment.fp.tell() >= self.segment_size:
+            self.start_segment()
+        for account_id, tanks in sorted(result, key=itemgetter(0)):
+            if tanks:
+                self.segment.write(account_id, map(self.to_tank_instance, tanks))
+                self.account_count += 1
+                self.tank_count += len(tanks)
+                self.last_existing_id = max(account_id, self.last_existing_id or account_id)
+            else:
+                self.segment.skip(account_id)
+        self.segment.flush()
+        # Advance over contiguously consumed requests.
+        account_ids = [account_id for account_id, _ in result]
+        self.next_ids[min(account_ids)] = self.next_id(max(account_ids) + 1)
+        while self.expected_id in self.next_ids:
+            self.expected_id = self.next_ids.pop(self.expected_id)
+
+    def start_segment(self):
+        self.close_segment()
+        self.paths.append(os.path.join(self.directory, "%d.dump" % len(self.paths)))
+        self.segment = AccountStatsWriter(open(self.paths[-1], "wb"), keep_empty=self.keep_empty)
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.fp.close()
+            self.segment = None
+
+    def merge(self):
+        """
+        Sorts every segment in memory and merges them into the writer.
+        Up to merge_fan_in segments are merged at once, so more segments are merged in several passes.
+        """
+        self.close_segment()
+        for path in self.paths:
+            with open(path, "rb") as fp:
+                records = sorted(DumpReader(fp), key=itemgetter(0))
+            with open(path, "wb") as fp:
+                writer = AccountStatsWriter(fp)
+                for account_id, tanks in records:
+                    writer.write(account_id, tanks)
+                writer.close()
+            del records
+        paths, pass_index = self.paths, 0
+        while len(paths) > self.merge_fan_in:
+            # Merging consecutive segments keeps the newest ones last.
+            merged_paths = []
+            for index, group in enumerate(chop(paths, self.merge_fan_in)):
+                merged_paths.append(os.path.join(self.directory, "merged-%d-%d.dump" % (pass_index, index)))
+                with open(merged_paths[-1], "wb") as fp:
+                    writer = AccountStatsWriter(fp, keep_empty=self.keep_empty)
+                    self.merge_segments(group, writer)
+                    writer.close()
+            paths, pass_index = merged_paths, pass_index + 1
+        self.merge_segments(paths, self.writer)
+
+    @staticmethod
+    def merge_segments(paths: typing.List[str], writer):
+        """Merges the sorted segments into the writer and removes them."""
+        segments = [open(path, "rb") for path in paths]
+        try:
+            readers = [DumpReader(segment, block_size=SPILL_BLOCK_SIZE) for segment in segments]
+            for account_id, tanks, _ in merge_records(readers, MERGE_POLICIES["newest"]):
+                if tanks:
+                    writer.write(account_id, tanks)
+                else:
+                    writer.skip(account_id)
+        finally:
+            for segment in segments:
+                segment.close()
+        for path in paths:
+            os.remove(path)
+
+
 # Helpers.
 # ------------------------------------------------------------------------------
 
@@ -459,19 +1726,96 @@ def pretty_print(obj, fp, indent=""):
         fp.write("%r" % obj)
 
 
+def make_partitions(fp, jobs: int) -> typing.List["Partition"]:
+    """Splits dump file into partitions for worker processes."""
+    if not os.path.isfile(fp.name) or hasattr(fp, "compression"):
+        raise click.ClickException("parallel mode needs an uncompressed dump file")
+    return partition_dump(fp.name, max(jobs, os.path.getsize(fp.name) // PARTITION_SIZE + 1))
+
+
+def format_partition(dump: str, partition: "Partition", make_reader) -> str:
+    """Formats dump partition for `cat`."""
+    with open(dump, "rb") as fp:
+        reader = make_reader(fp)
+        return "".join(
+            "%d %d %d %d\n" % ((account_id, ) + tank)
+            for account_id, tanks in read_partition(reader, partition)
+            for tank in tanks
+        )
+
+
+def write_csv_rows(records, writer, all_tanks: list):
+    """Writes account stats as CSV rows of battles and wins of all tanks."""
+    for account_id, tanks in records:
+        account_tanks = {tank.tank_id: tank for tank in tanks}
+        writer.writerow(itertools.chain([account_id], *(
+            [account_tanks[tank_id].battles, account_tanks[tank_id].wins]
+            if tank_id in account_tanks
+            else ["", ""]
+            for tank_id, _ in all_tanks
+        )))
+
+
+def format_csv_partition(dump: str, partition: "Partition", make_reader) -> str:
+    """Formats dump partition for `csv`."""
+    output = io.StringIO()
+    with open(dump, "rb") as fp:
+        reader = make_reader(fp)
+        write_csv_rows(read_partition(reader, partition), csv.writer(output), sorted(encyclopedia.TANKS.items()))
+    return output.getvalue()
+
+
+def diff_partition(new: str, partition: "Partition", old: str, make_reader) -> list:
+    """Makes difference of new dump partition and the same account range of old dump."""
+    with open(old, "rb") as old_fp, open(new, "rb") as new_fp:
+        old_reader, new_reader = make_reader(old_fp), make_reader(new_fp)
+        old_partition = partition._replace(
+            start=find_record_offset(old_reader, partition.start_id, DumpIndex.load(old)),
+            end=old_fp.seek(0, os.SEEK_END),
+        )
+        diff_stats = enumerate_batch_diff(
+            read_partition_batches(old_reader, old_partition),
+            read_partition_batches(new_reader, partition),
+        )
+        return [
+            (account_id, list(tanks))
+            for account_id, tanks in itertools.groupby(diff_stats, attrgetter("account_id"))
+        ]
+
+
 # Serialization.
 # ------------------------------------------------------------------------------
 
+def uvarint_bytes(value: int) -> bytes:
+    """Encodes unsigned varint value."""
+    buffer = bytearray()
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+    return bytes(buffer)
+
+
+UVARINT_TABLE_SIZE = 16384
+UVARINT_TABLE = [uvarint_bytes(value) for value in range(UVARINT_TABLE_SIZE)]
+
+
+def encode_uvarint(value: int, buffer: bytearray):
+    """Appends unsigned varint value to the buffer."""
+    if value < 0x80:
+        buffer.append(value)
+    elif value < UVARINT_TABLE_SIZE:
+        buffer += UVARINT_TABLE[value]
+    else:
+        buffer += uvarint_bytes(value)
+
+
 def write_uvarint(value: int, fp):
     """Writes unsigned varint value."""
     assert value >= 0, value
-    while True:
-        value, byte = value >> 7, value & 0x7F
-        if value:
-            byte |= 0x80
-        fp.write(bytes((byte, )))
-        if not value:
-            break
+    buffer = bytearray()
+    encode_uvarint(value, buffer)
+    fp.write(buffer)
 
 
 def read_uvarint(fp) -> int:
@@ -489,19 +1833,92 @@ def read_uvarints(count, fp):
         yield read_uvarint(fp)
 
 
-def write_account_stats(account_id: int, tanks, fp) -> int:
-    """Writes account stats into file."""
+def decode_uvarint(buffer, position: int) -> typing.Tuple[int, int]:
+    """Decodes unsigned varint value at the position. Returns the value and the next position."""
+    value = shift = 0
+    for position in range(position, len(buffer)):
+        byte = buffer[position]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position + 1
+        shift += 7
+    raise ValueError("incomplete uvarint")
+
+
+def encode_account_stats(account_id: int, tanks, buffer: bytearray) -> int:
+    """Appends account stats record to the buffer. Returns tank count."""
     tanks = list(tanks)
-    fp.write(b">>")
-    write_uvarint(account_id, fp)
-    write_uvarint(len(tanks), fp)
+    buffer += b">>"
+    encode_uvarint(account_id, buffer)
+    encode_uvarint(len(tanks), buffer)
     for tank in tanks:
-        write_uvarint(tank.tank_id, fp)
-        write_uvarint(tank.battles, fp)
-        write_uvarint(tank.wins, fp)
+        for value in (tank.tank_id, tank.battles, tank.wins):
+            # Inlined encode_uvarint.
+            if value < 0x80:
+                buffer.append(value)
+            elif value < UVARINT_TABLE_SIZE:
+                buffer += UVARINT_TABLE[value]
+            else:
+                buffer += uvarint_bytes(value)
     return len(tanks)
 
 
+def write_account_stats(account_id: int, tanks, fp) -> int:
+    """Writes account stats into file."""
+    buffer = bytearray()
+    tank_count = encode_account_stats(account_id, tanks, buffer)
+    fp.write(buffer)
+    return tank_count
+
+
+class AccountStatsWriter:
+    """
+    Encodes account stats into reusable buffer and writes it at once.
+    With keep_empty skipped accounts are written without tanks, so that they can be skipped again on merge.
+    """
+
+    def __init__(self, fp, flush_size=1048576, offset=0, keep_empty=False):
+        self.fp = fp
+        self.flush_size = flush_size
+        self.buffer = bytearray()
+        self.offset = offset
+        self.keep_empty = keep_empty
+
+    def write(self, account_id: int, tanks) -> int:
+        """Writes account stats. Returns tank count."""
+        tank_count = encode_account_stats(account_id, tanks, self.buffer)
+        if len(self.buffer) >= self.flush_size:
+            self.flush()
+        return tank_count
+
+    def skip(self, account_id: int):
+        """Notes the requested account without tanks."""
+        if self.keep_empty:
+            self.write(account_id, [])
+
+    def append(self, fp):
+        """Copies version 1 dump file as is."""
+        self.flush()
+        for chunk in iter(partial(fp.read, BLOCK_SIZE), b""):
+            self.fp.write(chunk)
+            self.offset += len(chunk)
+
+    def flush(self):
+        """Writes buffered records into file."""
+        if self.buffer:
+            self.fp.write(self.buffer)
+            self.offset += len(self.buffer)
+            del self.buffer[:]
+
+    def checkpoint(self) -> dict:
+        """Writes buffered records. Gets the writer state."""
+        self.flush()
+        return {}
+
+    def close(self):
+        self.flush()
+
+
 def read_account_stats(fp) -> typing.Tuple[int, typing.List["Tank"]]:
     """Reads account stats from file."""
     if not fp.read(2):
@@ -511,6 +1928,1352 @@ def read_account_stats(fp) -> typing.Tuple[int, typing.List["Tank"]]:
     return account_id, [Tank(*read_uvarints(3, fp)) for _ in range(tank_count)]
 
 
+# Block decoding.
+# ------------------------------------------------------------------------------
+
+def check_record(values: list, index: int, last_account_id: int, is_last: bool) -> typing.Optional[int]:
+    """
+    Checks if a plausible record starts at the index: valid marker, increasing account ID, sane tank count.
+    The record must be followed by the next record marker and a greater account ID or by the end of file.
+    Returns the record end index, -1 if more values are needed or None if the record is not plausible.
+    """
+    count = len(values)
+    if index + 4 > count:
+        if any(value != RECORD_MARKER for value in values[index:index + 2]):
+            return None
+        return -1
+    if values[index] != RECORD_MARKER or values[index + 1] != RECORD_MARKER:
+        return None
+    account_id = values[index + 2]
+    if not last_account_id < account_id < MAX_ACCOUNT_ID or values[index + 3] > MAX_TANK_COUNT:
+        return None
+    end = index + 4 + 3 * values[index + 3]
+    if end > count or (end + 3 > count and not is_last):
+        return -1
+    if any(value != RECORD_MARKER for value in values[end:end + 2]):
+        return None
+    if end + 2 < count and values[end + 2] <= account_id:
+        return None
+    return end
+
+
+def decode_uvarints_python(buffer) -> typing.Tuple[list, list]:
+    """
+    Decodes all complete uvarints in the buffer.
+    Returns values and their end offsets. Trailing incomplete uvarint is ignored.
+    """
+    values, ends = [], []
+    value = shift = 0
+    for offset, byte in enumerate(buffer, 1):
+        if byte & 0x80:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            values.append(value | (byte << shift))
+            ends.append(offset)
+            value = shift = 0
+    return values, ends
+
+
+def decode_uvarints_numpy(buffer) -> typing.Tuple[list, list]:
+    """
+    Vectorized version of decode_uvarints_python.
+    Values must fit into 64 bits.
+    """
+    data = numpy.frombuffer(buffer, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(data < 0x80) + 1
+    if not len(ends):
+        return [], []
+    data = data[:ends[-1]]
+    starts = numpy.empty_like(ends)
+    starts[0], starts[1:] = 0, ends[:-1]
+    # Position of every byte within its uvarint.
+    positions = numpy.arange(len(data)) - numpy.repeat(starts, ends - starts)
+    parts = numpy.left_shift((data & 0x7F).astype(numpy.uint64), (7 * positions).astype(numpy.uint64))
+    return numpy.add.reduceat(parts, starts).tolist(), ends.tolist()
+
+
+decode_uvarints = decode_uvarints_python if numpy is None else decode_uvarints_numpy
+
+
+def decode_block(buffer) -> typing.Tuple[list, list, list]:
+    """
+    Decodes all uvarints in the buffer and finds complete account records.
+    Returns values, their end offsets and record boundaries.
+    Record i occupies values[boundaries[i]:boundaries[i + 1]].
+    """
+    values, ends = decode_uvarints(buffer)
+    boundaries, index, count = [0], 0, len(values)
+    # Record is: 2 marker bytes, account ID, tank count and tank triples.
+    while index + 4 <= count:
+        index += 4 + 3 * values[index + 3]
+        if index > count:
+            break  # incomplete record
+        boundaries.append(index)
+    return values, ends, boundaries
+
+
+class DumpReader:
+    """
+    Reads account records from dump by large blocks. Detects dump format version.
+    In mmap mode the dump is decoded right from the memory map without copying.
+    In tolerant mode corrupted data is skipped up to the next plausible record or block.
+    Otherwise the specified number of chunks may be read ahead in a background thread.
+    """
+
+    def __init__(self, fp, block_size=BLOCK_SIZE, use_mmap=False, tolerant=False, prefetch=0):
+        if prefetch and not use_mmap:
+            fp = PrefetchFile(fp, prefetch)
+        self.fp = fp
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.tolerant = tolerant
+        self.skipped_size = 0
+        self.offset = fp.tell() if fp.seekable() else 0
+        self.buffer = b""
+        self.mapped = self.view = None
+        # Detect format version.
+        self.version, self.header, self.tank_table = 1, {}, None
+        magic = fp.read(len(DUMP_MAGIC))
+        if magic == DUMP_MAGIC:
+            header_size = read_uvarint(fp)
+            self.version, self.header = 2, json.loads(fp.read(header_size).decode("utf-8"))
+            # Pipes can't tell the offset.
+            self.offset += len(DUMP_MAGIC) + len(uvarint_bytes(header_size)) + header_size
+            self.data_offset = self.offset
+            self.is_sequential = True
+            if "tank_ids" in self.header:
+                self.tank_table = TankTable(self.header["tank_ids"])
+        elif not use_mmap:
+            self.buffer = magic
+        self.checksum = self.header.get("checksum") == "crc32"
+
+    def tell(self) -> int:
+        """Gets offset of the first unread record or block."""
+        return self.offset
+
+    def seek(self, offset: int):
+        """Moves to the record or block at the offset."""
+        self.fp.seek(offset)
+        self.offset, self.buffer = offset, b""
+        if self.tank_table is not None and offset != self.data_offset:
+            self.is_sequential = False  # skipped blocks may have added tank IDs
+
+    def __iter__(self):
+        """Reads all account stats."""
+        for _, account_id, tanks in self.records():
+            yield account_id, tanks
+
+    def records(self):
+        """Reads all (offset, account_id, tanks) records. Version 2 dumps give offsets of blocks."""
+        if self.version == 2:
+            records = self.decode_blocks()
+        else:
+            records = self.decode_records_tolerantly() if self.tolerant else self.decode_records()
+        return self.decode_mapped(records)
+
+    def decode_mapped(self, items):
+        """Runs the decoding generator over the memory map in mmap mode."""
+        if self.use_mmap:
+            if hasattr(self.fp, "compression"):
+                raise click.ClickException("compressed dump can't be memory-mapped")
+            if not os.fstat(self.fp.fileno()).st_size:
+                return  # empty file can't be mapped
+            self.mapped = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mapped)
+        try:
+            yield from items
+        finally:
+            if self.view is not None:
+                self.view.release()
+                self.view = None
+                self.mapped.close()
+
+    def decode_values(self):
+        """Decodes version 1 dump by blocks. Yields (values, ends, boundaries) of complete records."""
+        size = self.block_size
+        while True:
+            buffer = self.read_block(size)
+            if not buffer:
+                break  # end of file
+            is_last = len(buffer) < size
+            values, ends, boundaries = decode_block(buffer)
+            del buffer  # release the memory map
+            if len(boundaries) == 1:
+                if is_last:
+                    raise ValueError("unexpected end of file at offset %d" % self.offset)
+                size *= 2  # record doesn't fit into the block
+                continue
+            yield values, ends, boundaries
+            self.consume(ends[boundaries[-1] - 1])
+            size = self.block_size
+
+    def decode_records(self):
+        for values, ends, boundaries in self.decode_values():
+            for i in range(len(boundaries) - 1):
+                start, end = boundaries[i], boundaries[i + 1]
+                tanks = iter(values[start + 4:end])
+                yield (
+                    self.offset + (ends[start - 1] if start else 0),
+                    values[start + 2],
+                    list(map(Tank._make, zip(tanks, tanks, tanks))),
+                )
+
+    def decode_records_tolerantly(self):
+        """
+        Validates every record. Skips data up to the next plausible record on mismatch.
+        Note that a record followed by a damaged record marker is skipped as well.
+        """
+        size, last_account_id = self.block_size, -1
+        while True:
+            buffer = self.read_block(size)
+            if not buffer:
+                break  # end of file
+            is_last = len(buffer) < size
+            values, ends = decode_uvarints(buffer)
+            index = consumed = 0
+            while True:
+                end = check_record(values, index, last_account_id, is_last)
+                if end is not None and end != -1:
+                    tanks = iter(values[index + 4:end])
+                    yield self.offset + consumed, values[index + 2], list(map(Tank._make, zip(tanks, tanks, tanks)))
+                    last_account_id, index, consumed = values[index + 2], end, ends[end - 1]
+                    continue
+                if end == -1 and not is_last:
+                    self.consume(consumed)
+                    size = size * 2 if not index else self.block_size  # record doesn't fit into the block
+                    break
+                if end == -1 and consumed == len(buffer):
+                    self.consume(consumed)
+                    break
+                # Skip to the next record marker.
+                position = self.find_marker(buffer, consumed + 1)
+                if position == -1:
+                    # The last byte may be the first half of the marker.
+                    position = len(buffer) if is_last else max(len(buffer) - 1, consumed + 1)
+                logging.warning("Skipped %d bytes at offset %d.", position - consumed, self.offset + consumed)
+                self.skipped_size += position - consumed
+                index = bisect.bisect_left(ends, position)
+                if index == len(ends) or ends[index] != position:
+                    self.consume(position)
+                    break  # the marker isn't aligned with the decoded values
+                index, consumed = index + 1, position
+            del buffer  # release the memory map
+
+    def find_marker(self, buffer, start: int) -> int:
+        """Finds the next record marker in the buffer."""
+        if self.view is None:
+            return buffer.find(b">>", start)
+        position = self.mapped.find(b">>", self.offset + start, self.offset + len(buffer))
+        return position - self.offset if position != -1 else -1
+
+    def decode_blocks(self):
+        block_class = BLOCK_CLASSES[self.header.get("layout", "rows")]
+        for offset, buffer in self.decompress_blocks():
+            if self.tank_table is None:
+                for account_id, tanks in block_class.decode(buffer, offset):
+                    yield offset, account_id, tanks
+                continue
+            for account_id, tanks in block_class.decode(buffer, offset, self.tank_table.tank_ids):
+                if not self.tank_table.is_sorted:
+                    tanks.sort()
+                yield offset, account_id, tanks
+
+    def decompress_blocks(self):
+        """
+        Reads (offset, decompressed block) pairs of version 2 dump.
+        In tolerant mode bad blocks are skipped using the block directory.
+        Without the directory reading stops at the first bad block.
+        """
+        _, decompress = CODECS[self.header["codec"]]
+        if self.tolerant:
+            offset = self.offset
+            try:
+                _, offsets = self.read_directory()
+            except ValueError:
+                logging.warning("Block directory is not found, reading up to the first bad block.")
+                offsets = None
+            self.seek(offset)
+        while True:
+            offset = self.offset
+            try:
+                payload = self.read_frame()
+                if payload is None:
+                    break  # end of blocks
+                buffer = decompress(payload)
+            except (ValueError, zlib.error, lzma.LZMAError) as e:
+                if not self.tolerant:
+                    raise
+                if not offsets:
+                    logging.warning("Stopped at bad block at offset %d: %s", offset, e)
+                    break
+                next_offset = offsets[bisect.bisect_right(offsets, offset)] if offset < offsets[-1] else None
+                logging.warning("Skipped block at offset %d: %s", offset, e)
+                if next_offset is None:
+                    break
+                self.skipped_size += next_offset - offset
+                self.seek(next_offset)
+                continue
+            del payload  # release the memory map
+            if self.tank_table is not None:
+                if not self.is_sequential and not self.tank_table.is_complete:
+                    next_offset = self.offset
+                    self.tank_table = TankTable(self.read_tank_ids(), is_complete=True)
+                    self.seek(next_offset)
+                buffer = buffer[self.tank_table.decode_new_tank_ids(buffer):]
+            yield offset, buffer
+
+    def columns(self, names=None, batch_size=BATCH_SIZE):
+        """
+        Reads the specified columns by batches. Yields dicts of value lists.
+        Only columnar dumps skip decoding of unneeded columns.
+        """
+        names = ColumnarBlock.COLUMNS if names is None else names
+        if self.version == 2 and self.header.get("layout") == "columns":
+            for offset, buffer in self.decompress_blocks():
+                if self.tank_table is None:
+                    yield ColumnarBlock.decode_columns(buffer, offset, names)
+                elif self.tank_table.is_sorted or "tank_ids" not in names:
+                    yield ColumnarBlock.decode_columns(buffer, offset, names, self.tank_table.tank_ids)
+                else:
+                    # Mapped tank IDs are out of order, so the tanks have to be re-sorted.
+                    columns = ColumnarBlock.decode_columns(buffer, offset, tank_ids=self.tank_table.tank_ids)
+                    ColumnarBlock.sort_tanks(columns)
+                    yield {name: columns[name] for name in names}
+            return
+        for records in chop(self, batch_size):
+            columns = {
+                "account_ids": [account_id for account_id, _ in records],
+                "tank_counts": [len(tanks) for _, tanks in records],
+                "tank_ids": [tank.tank_id for _, tanks in records for tank in tanks],
+                "battles": [tank.battles for _, tanks in records for tank in tanks],
+                "wins": [tank.wins for _, tanks in records for tank in tanks],
+            }
+            yield {name: columns[name] for name in names}
+
+    def batches(self, batch_size=BATCH_SIZE):
+        """
+        Reads tanks by TankBatch batches.
+        Version 1 and columnar dumps are batched by blocks without making Tank instances.
+        """
+        if self.version == 2 and self.header.get("layout") == "columns":
+            return map(TankBatch.from_columns, self.columns())
+        if self.version == 1 and not self.tolerant:
+            return self.decode_mapped(
+                TankBatch.from_values(values, boundaries) for values, _, boundaries in self.decode_values())
+        return make_batches(self, batch_size)
+
+    def read_frame(self):
+        """
+        Reads length-prefixed block and checks its CRC32 if present.
+        Returns None on the terminating empty block.
+        """
+        try:
+            length, start = decode_uvarint(self.read_block(10), 0)
+        except ValueError:
+            raise ValueError("unexpected end of file at offset %d" % self.offset)
+        if not length:
+            self.consume(start)
+            return None
+        if self.checksum:
+            start += 4
+        size = start + length
+        frame = self.read_block(size)
+        if len(frame) < size:
+            raise ValueError("unexpected end of file at offset %d" % self.offset)
+        payload = frame[start:size]
+        if self.checksum and zlib.crc32(payload) != int.from_bytes(frame[start - 4:start], "little"):
+            raise ValueError("checksum mismatch at offset %d" % self.offset)
+        self.consume(size)
+        return payload
+
+    def read_block(self, size: int):
+        """Gets up to size bytes starting from the current offset."""
+        if self.view is not None:
+            return self.view[self.offset:self.offset + size]
+        if len(self.buffer) < size:
+            self.buffer += self.fp.read(size - len(self.buffer))
+        return self.buffer
+
+    def consume(self, size: int):
+        """Advances the current offset."""
+        self.offset += size
+        if self.view is None:
+            self.buffer = self.buffer[size:]
+
+    def read_tail(self) -> typing.Tuple[int, int]:
+        """Reads directory offset and block count of version 2 dump."""
+        if self.fp.seek(0, os.SEEK_END) < DUMP_TAIL.size:
+            raise ValueError("block directory is not found")
+        self.fp.seek(-DUMP_TAIL.size, os.SEEK_END)
+        directory_offset, block_count, magic = DUMP_TAIL.unpack(self.fp.read(DUMP_TAIL.size))
+        if magic != DUMP_END_MAGIC:
+            raise ValueError("block directory is not found")
+        return directory_offset, block_count
+
+    def read_directory(self) -> typing.Tuple[array.array, array.array]:
+        """Reads first account IDs and offsets of version 2 dump blocks."""
+        directory_offset, block_count = self.read_tail()
+        self.fp.seek(directory_offset)
+        return read_packed_arrays(self.fp, 2, block_count)
+
+    def read_footer(self) -> dict:
+        """Reads summary footer of version 2 dump. It follows the block directory."""
+        directory_offset, block_count = self.read_tail()
+        footer_offset = directory_offset + 2 * 8 * block_count
+        footer_size = self.fp.seek(0, os.SEEK_END) - DUMP_TAIL.size - footer_offset
+        self.fp.seek(footer_offset)
+        return json.loads(self.fp.read(footer_size).decode("utf-8"))
+
+    def read_tank_ids(self) -> typing.List[int]:
+        """
+        Reads the final tank table of version 2 dump.
+        Dumps without the table in the footer are scanned for new tank IDs of every block.
+        """
+        try:
+            tank_ids = self.read_footer().get("tank_ids")
+        except ValueError:
+            tank_ids = None
+        if tank_ids is not None:
+            return tank_ids
+        _, decompress = CODECS[self.header["codec"]]
+        tank_table = TankTable(self.header["tank_ids"])
+        self.fp.seek(self.data_offset)
+        self.offset, self.buffer = self.data_offset, b""
+        while True:
+            try:
+                payload = self.read_frame()
+                if payload is None:
+                    break
+                tank_table.decode_new_tank_ids(decompress(payload))
+            except (ValueError, zlib.error, lzma.LZMAError):
+                break
+        return tank_table.tank_ids
+
+
+# Read-ahead.
+# ------------------------------------------------------------------------------
+
+def prefetch(iterable, depth: int):
+    """
+    Iterates over the iterable in a background thread keeping up to depth items ready.
+    Exceptions are re-raised in the consuming thread.
+    """
+    items, stopped = queue.Queue(depth), threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+        except Exception as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    thread = threading.Thread(target=run, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            is_item, item = items.get()
+            if not is_item:
+                if item is not None:
+                    raise item
+                break
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class PrefetchFile:
+    """
+    Read-only file wrapper which reads chunks ahead in a background thread.
+    Seeking restarts reading ahead from the new offset.
+    """
+
+    def __init__(self, fp, depth: int, chunk_size=BLOCK_SIZE):
+        self.fp = fp
+        self.name = getattr(fp, "name", None)
+        self.depth = depth
+        self.chunk_size = chunk_size
+        self.offset = fp.tell() if fp.seekable() else 0
+        self.chunks = prefetch(iter(partial(fp.read, chunk_size), b""), depth)
+        self.chunk, self.position = b"", 0
+
+    def read(self, size=-1) -> bytes:
+        parts = []
+        while size:
+            if self.position == len(self.chunk):
+                self.chunk, self.position = next(self.chunks, b""), 0
+                if not self.chunk:
+                    break  # end of file
+            end = len(self.chunk) if size < 0 else min(self.position + size, len(self.chunk))
+            parts.append(self.chunk[self.position:end])
+            size -= end - self.position if size > 0 else 0
+            self.position = end
+        data = b"".join(parts)
+        self.offset += len(data)
+        return data
+
+    def seek(self, offset: int, whence=os.SEEK_SET) -> int:
+        self.chunks.close()  # stop reading ahead
+        if whence == os.SEEK_CUR:
+            offset, whence = self.offset + offset, os.SEEK_SET
+        self.offset = self.fp.seek(offset, whence)
+        self.chunks = prefetch(iter(partial(self.fp.read, self.chunk_size), b""), self.depth)
+        self.chunk, self.position = b"", 0
+        return self.offset
+
+    def tell(self) -> int:
+        return self.offset
+
+    def seekable(self) -> bool:
+        return self.fp.seekable()
+
+    def fileno(self) -> int:
+        return self.fp.fileno()
+
+    def close(self):
+        self.chunks.close()
+
+
+# Compression.
+# ------------------------------------------------------------------------------
+
+def wrap_compressed(fp, mode: str):
+    """
+    Wraps binary file to decompress input or compress output if needed.
+    Closing the wrapper doesn't close the file.
+    """
+    if "r" in mode:
+        compression = detect_compression(fp)
+    else:
+        compression = next((
+            name for name, (extension, _, _) in COMPRESSIONS.items()
+            if str(getattr(fp, "name", "")).endswith(extension)
+        ), None)
+    if compression is None:
+        return fp
+    return (DecompressedFile if "r" in mode else CompressedFile)(fp, compression)
+
+
+def detect_compression(fp) -> typing.Optional[str]:
+    """Detects compression of input file by magic bytes."""
+    if hasattr(fp, "peek"):
+        head = fp.peek(8)[:8]
+    elif fp.seekable():
+        head = fp.read(8)
+        fp.seek(-len(head), os.SEEK_CUR)
+    else:
+        return None
+    return next((name for name, (_, magic, _) in COMPRESSIONS.items() if head.startswith(magic)), None)
+
+
+class DecompressedFile(PrefetchFile):
+    """Decompresses input file in a background thread."""
+
+    def __init__(self, fp, compression: str):
+        _, _, open_ = COMPRESSIONS[compression]
+        super().__init__(open_(fp, "rb"), COMPRESSION_QUEUE_SIZE)
+        self.name = getattr(fp, "name", None)
+        self.compression = compression
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("compressed file can't be memory-mapped")
+
+    def close(self):
+        super().close()
+        self.fp.close()
+
+
+class CompressedFile:
+    """
+    Write-only file wrapper which compresses output in a background thread.
+    Offsets are of uncompressed data.
+    """
+
+    def __init__(self, fp, compression: str):
+        _, _, open_ = COMPRESSIONS[compression]
+        self.fp = open_(fp, "wb")
+        self.name = getattr(fp, "name", None)
+        self.compression = compression
+        self.offset = 0
+        self.error = None
+        self.chunks = queue.Queue(COMPRESSION_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.run, name="compress", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            chunk = self.chunks.get()
+            try:
+                if chunk is None:
+                    return
+                if self.error is None:
+                    self.fp.write(chunk)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.chunks.task_done()
+
+    def write(self, data) -> int:
+        self.check()
+        self.chunks.put(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def flush(self):
+        """Waits for the written data to be compressed."""
+        self.chunks.join()
+        self.check()
+        self.fp.flush()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.chunks.put(None)
+            self.thread.join()
+            self.fp.close()
+        self.check()
+
+    def check(self):
+        """Re-raises compression error."""
+        if self.error is not None:
+            raise self.error
+
+    def tell(self) -> int:
+        return self.offset
+
+    def seekable(self) -> bool:
+        return False
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("compressed file has no file descriptor")
+
+
+# Block dumps.
+# ------------------------------------------------------------------------------
+
+DUMP_MAGIC = b"WOTDUMP\x02"
+DUMP_END_MAGIC = b"WOTDEND\x02"
+DUMP_TAIL = struct.Struct("<QQ8s")  # directory offset, block count, magic
+
+
+class RowBlock:
+    """Block of records in the version 1 layout."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def write(self, account_id: int, tanks) -> int:
+        return encode_account_stats(account_id, tanks, self.buffer)
+
+    def pop(self) -> bytes:
+        """Gets encoded block and starts a new one."""
+        buffer, self.buffer = bytes(self.buffer), bytearray()
+        return buffer
+
+    @staticmethod
+    def decode(buffer, offset: int, tank_ids: list = None):
+        """
+        Decodes all (account_id, tanks) records of the block at the offset.
+        Tank indexes are mapped to tank IDs if the table is specified.
+        """
+        values, ends, boundaries = decode_block(buffer)
+        if not ends or boundaries[-1] != len(values) or ends[-1] != len(buffer):
+            raise ValueError("corrupted block at offset %d" % offset)
+        for i in range(len(boundaries) - 1):
+            start, end = boundaries[i], boundaries[i + 1]
+            tanks = values[start + 4:end]
+            if tank_ids is not None:
+                tanks[::3] = [tank_ids[index] for index in tanks[::3]]
+            tanks = iter(tanks)
+            yield values[start + 2], list(map(Tank._make, zip(tanks, tanks, tanks)))
+
+
+class ColumnarBlock:
+    """
+    Block of records split into separate uvarint columns.
+    Account IDs are delta-encoded. Tank IDs are delta-encoded within an account.
+    Every column is prefixed with its length, so unneeded columns can be skipped.
+    """
+
+    COLUMNS = ("account_ids", "tank_counts", "tank_ids", "battles", "wins")
+
+    def __init__(self):
+        self.columns = [bytearray() for _ in self.COLUMNS]
+        self.last_account_id = 0
+
+    def __len__(self) -> int:
+        return sum(map(len, self.columns))
+
+    def write(self, account_id: int, tanks) -> int:
+        tanks = list(tanks)
+        account_ids, tank_counts, tank_ids, battles, wins = self.columns
+        if account_id < self.last_account_id:
+            raise ValueError("account IDs must be sorted: #%d" % account_id)
+        encode_uvarint(account_id - self.last_account_id, account_ids)
+        encode_uvarint(len(tanks), tank_counts)
+        last_tank_id = 0
+        for tank in tanks:
+            if tank.tank_id < last_tank_id:
+                raise ValueError("tank IDs must be sorted: #%d" % account_id)
+            encode_uvarint(tank.tank_id - last_tank_id, tank_ids)
+            encode_uvarint(tank.battles, battles)
+            encode_uvarint(tank.wins, wins)
+            last_tank_id = tank.tank_id
+        self.last_account_id = account_id
+        return len(tanks)
+
+    def pop(self) -> bytes:
+        """Gets encoded block and starts a new one."""
+        buffer = bytearray()
+        for column in self.columns:
+            encode_uvarint(len(column), buffer)
+            buffer += column
+        self.__init__()
+        return bytes(buffer)
+
+    @classmethod
+    def decode_columns(cls, buffer, offset: int, names=COLUMNS, tank_ids: list = None) -> dict:
+        """
+        Decodes only the specified columns of the block. IDs are decoded to absolute values.
+        Tank indexes are mapped to tank IDs if the table is specified.
+        """
+        names = set(names)
+        if "tank_ids" in names:
+            names.add("tank_counts")
+        columns, view, position = {}, memoryview(buffer), 0
+        for name in cls.COLUMNS:
+            length, start = decode_uvarint(view, position)
+            position = start + length
+            if position > len(view):
+                raise ValueError("corrupted block at offset %d" % offset)
+            if name in names:
+                columns[name], _ = decode_uvarints(view[start:position])
+        if position != len(view):
+            raise ValueError("corrupted block at offset %d" % offset)
+        view.release()
+        if "account_ids" in columns:
+            columns["account_ids"] = list(itertools.accumulate(columns["account_ids"]))
+        if "tank_ids" in columns:
+            deltas, ids, position = columns["tank_ids"], [], 0
+            for tank_count in columns["tank_counts"]:
+                ids.extend(itertools.accumulate(deltas[position:position + tank_count]))
+                position += tank_count
+            columns["tank_ids"] = ids if tank_ids is None else [tank_ids[index] for index in ids]
+        return columns
+
+    @staticmethod
+    def sort_tanks(columns: dict):
+        """Sorts tanks of every account by tank ID in place."""
+        tank_ids, battles, wins, position = [], [], [], 0
+        for tank_count in columns["tank_counts"]:
+            end = position + tank_count
+            for tank in sorted(zip(
+                columns["tank_ids"][position:end], columns["battles"][position:end], columns["wins"][position:end],
+            )):
+                tank_ids.append(tank[0])
+                battles.append(tank[1])
+                wins.append(tank[2])
+            position = end
+        columns["tank_ids"], columns["battles"], columns["wins"] = tank_ids, battles, wins
+
+    @classmethod
+    def decode(cls, buffer, offset: int, tank_ids: list = None):
+        """Decodes all (account_id, tanks) records of the block at the offset."""
+        columns = cls.decode_columns(buffer, offset, tank_ids=tank_ids)
+        tanks = list(zip(columns["tank_ids"], columns["battles"], columns["wins"]))
+        if len(tanks) != sum(columns["tank_counts"]) or len(columns["account_ids"]) != len(columns["tank_counts"]):
+            raise ValueError("corrupted block at offset %d" % offset)
+        position = 0
+        for account_id, tank_count in zip(columns["account_ids"], columns["tank_counts"]):
+            yield account_id, list(map(Tank._make, tanks[position:position + tank_count]))
+            position += tank_count
+
+
+BLOCK_CLASSES = {"columns": ColumnarBlock, "rows": RowBlock}
+
+
+class TankTable:
+    """
+    Maps tank IDs to dense indexes.
+    Initial table is stored in the dump header. Every block is prefixed with tank IDs it added to the table.
+    The final table is stored in the footer for readers that seek.
+    """
+
+    def __init__(self, tank_ids, is_complete=False):
+        self.tank_ids = list(tank_ids)
+        self.indexes = {tank_id: index for index, tank_id in enumerate(self.tank_ids)}
+        self.is_sorted = all(a < b for a, b in zip(self.tank_ids, self.tank_ids[1:]))
+        self.is_complete = is_complete
+        self.new_tank_ids = []
+
+    def index(self, tank_id: int) -> int:
+        """Gets tank index. Adds unknown tank to the table."""
+        try:
+            return self.indexes[tank_id]
+        except KeyError:
+            self.add(tank_id)
+            self.new_tank_ids.append(tank_id)
+            return self.indexes[tank_id]
+
+    def add(self, tank_id: int):
+        if self.tank_ids and tank_id < self.tank_ids[-1]:
+            self.is_sorted = False
+        self.indexes[tank_id] = len(self.tank_ids)
+        self.tank_ids.append(tank_id)
+
+    def encode_new_tank_ids(self) -> bytearray:
+        """Encodes tank IDs added since the previous call."""
+        buffer = bytearray()
+        encode_uvarint(len(self.new_tank_ids), buffer)
+        for tank_id in self.new_tank_ids:
+            encode_uvarint(tank_id, buffer)
+        self.new_tank_ids = []
+        return buffer
+
+    def decode_new_tank_ids(self, buffer) -> int:
+        """Adds tank IDs encoded in the buffer. Returns the encoded length."""
+        count, position = decode_uvarint(buffer, 0)
+        for _ in range(count):
+            tank_id, position = decode_uvarint(buffer, position)
+            if tank_id not in self.indexes:
+                self.add(tank_id)
+        return position
+
+
+class BlockDumpWriter:
+    """
+    Writes version 2 dump.
+    The header is JSON with the format version, creation time, encoding options and the given metadata.
+    Records are grouped into compressed blocks prefixed with length and CRC32. An empty block terminates them.
+    The block directory, JSON summary footer and the tail pointing to them are written on close.
+    """
+
+    def __init__(
+        self, fp, codec="zlib", layout="rows", tank_index=False, metadata=None, block_size=DUMP_BLOCK_SIZE, state=None,
+    ):
+        self.fp = fp
+        self.compress, _ = CODECS[codec]
+        self.block = BLOCK_CLASSES[layout]()
+        self.block_size = block_size
+        self.first_account_ids, self.offsets = array.array("Q"), array.array("Q")
+        self.account_count = self.tank_count = 0
+        self.last_existing_id = None
+        if state is not None:
+            # Continue the dump written up to the checkpoint.
+            self.offset = state["offset"]
+            self.first_account_ids.extend(state["first_account_ids"])
+            self.offsets.extend(state["offsets"])
+            self.account_count, self.tank_count = state["account_count"], state["tank_count"]
+            self.last_existing_id = state["last_existing_id"]
+            self.tank_table = TankTable(state["tank_ids"]) if tank_index else None
+            return
+        # Write header.
+        header = dict(metadata or {}, version=2, created=datetime.now().replace(microsecond=0).isoformat())
+        header.update(codec=codec, layout=layout, checksum="crc32")
+        if tank_index:
+            self.tank_table = TankTable(sorted(encyclopedia.TANKS))
+            header["tank_ids"] = self.tank_table.tank_ids
+        else:
+            self.tank_table = None
+        header = json.dumps(header, sort_keys=True).encode("utf-8")
+        buffer = bytearray(DUMP_MAGIC)
+        encode_uvarint(len(header), buffer)
+        self.offset = 0
+        self.write_raw(buffer + header)
+
+    def write(self, account_id: int, tanks) -> int:
+        """Writes account stats. Returns tank count."""
+        if not len(self.block):
+            self.first_account_ids.append(account_id)
+        if self.tank_table is not None:
+            tanks = sorted(Tank(self.tank_table.index(tank.tank_id), tank.battles, tank.wins) for tank in tanks)
+        tank_count = self.block.write(account_id, tanks)
+        self.account_count += 1
+        self.tank_count += tank_count
+        self.last_existing_id = account_id
+        if len(self.block) >= self.block_size:
+            self.flush_block()
+        return tank_count
+
+    def skip(self, account_id: int):
+        """Does nothing. Accounts without tanks are not written."""
+
+    def flush(self):
+        """Does nothing. Blocks are written as soon as they are full."""
+
+    def flush_block(self):
+        """Compresses and writes the current block."""
+        if not len(self.block):
+            return
+        buffer = self.block.pop()
+        if self.tank_table is not None:
+            buffer = bytes(self.tank_table.encode_new_tank_ids() + buffer)
+        payload = self.compress(buffer)
+        frame = bytearray()
+        encode_uvarint(len(payload), frame)
+        frame += zlib.crc32(payload).to_bytes(4, "little")
+        self.offsets.append(self.offset)
+        self.write_raw(frame + payload)
+
+    def checkpoint(self) -> dict:
+        """Writes the current block. Gets the writer state."""
+        self.flush_block()
+        return {
+            "offset": self.offset,
+            "first_account_ids": self.first_account_ids.tolist(),
+            "offsets": self.offsets.tolist(),
+            "account_count": self.account_count,
+            "tank_count": self.tank_count,
+            "last_existing_id": self.last_existing_id,
+            "tank_ids": self.tank_table.tank_ids if self.tank_table is not None else None,
+        }
+
+    def close(self):
+        """Writes the last block, the block directory and the footer."""
+        self.flush_block()
+        self.write_raw(b"\x00")
+        directory_offset = self.offset
+        write_packed_arrays(self.fp, self.first_account_ids, self.offsets)
+        self.offset += 2 * 8 * len(self.offsets)
+        footer = {
+            "account_count": self.account_count,
+            "tank_count": self.tank_count,
+            "last_existing_id": self.last_existing_id,
+        }
+        if self.tank_table is not None:
+            footer["tank_ids"] = self.tank_table.tank_ids
+        # The footer contains the total dump size including the footer itself.
+        size = 0
+        while True:
+            encoded = json.dumps(dict(footer, size=size), sort_keys=True).encode("utf-8")
+            if self.offset + len(encoded) + DUMP_TAIL.size == size:
+                break
+            size = self.offset + len(encoded) + DUMP_TAIL.size
+        self.write_raw(encoded)
+        self.write_raw(DUMP_TAIL.pack(directory_offset, len(self.offsets), DUMP_END_MAGIC))
+
+    def write_raw(self, data: bytes):
+        self.fp.write(data)
+        self.offset += len(data)
+
+
+def make_dump_writer(fp, format_=1, codec="zlib", layout="rows", tank_index=False, metadata=None):
+    """Makes dump writer of the specified format version. Version 1 has neither options nor metadata."""
+    return BlockDumpWriter(fp, codec, layout, tank_index, metadata) if format_ == 2 else AccountStatsWriter(fp)
+
+
+def resume_dump_writer(fp, checkpoint: "CrawlCheckpoint"):
+    """Truncates dump to the checkpoint offset. Makes writer which continues the dump with the same options."""
+    header = DumpReader(fp).header
+    fp.truncate(checkpoint.offset)
+    fp.seek(checkpoint.offset)
+    if not header:
+        return AccountStatsWriter(fp, offset=checkpoint.offset)
+    return BlockDumpWriter(
+        fp, header["codec"], header["layout"], "tank_ids" in header, state=checkpoint.writer_state)
+
+
+def get_metadata(header: dict) -> dict:
+    """Gets metadata to be copied from the header of another dump."""
+    return {key: header[key] for key in ("start_id", "end_id") if key in header}
+
+
+def write_packed_arrays(fp, *arrays):
+    """Writes arrays as little-endian."""
+    for values in arrays:
+        if sys.byteorder == "big":
+            values = array.array(values.typecode, values)
+            values.byteswap()
+        values.tofile(fp)
+
+
+def read_packed_arrays(fp, array_count: int, length: int, typecode="Q") -> typing.List[array.array]:
+    """Reads little-endian arrays of the same length."""
+    arrays = []
+    for _ in range(array_count):
+        values = array.array(typecode)
+        values.fromfile(fp, length)
+        if sys.byteorder == "big":
+            values.byteswap()
+        arrays.append(values)
+    return arrays
+
+
+# Indexing.
+# ------------------------------------------------------------------------------
+
+class DumpIndex:
+    """
+    Sparse account offset index. Stored next to the dump.
+    Keeps account ID and offset of every N-th record as packed arrays.
+    The dump size is kept as well, so that the index of a rewritten dump is ignored.
+    """
+
+    EXTENSION = ".idx"
+    MAGIC = b"WOTIDX02"
+    HEADER = struct.Struct("<8sQQQ")  # magic, interval, dump size, entry count
+
+    def __init__(self, interval: int, size: int, account_ids: array.array, offsets: array.array):
+        self.interval = interval
+        self.size = size
+        self.account_ids = account_ids
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, reader: "DumpReader", interval: int, size: int) -> "DumpIndex":
+        """Builds index by scanning the dump."""
+        account_ids, offsets = array.array("Q"), array.array("Q")
+        for i, (offset, account_id, _) in enumerate(reader.records()):
+            if i % interval == 0:
+                account_ids.append(account_id)
+                offsets.append(offset)
+        return cls(interval, size, account_ids, offsets)
+
+    @classmethod
+    def load(cls, dump: str) -> typing.Optional["DumpIndex"]:
+        """Loads index of the dump if it exists and matches the dump size."""
+        try:
+            with open(dump + cls.EXTENSION, "rb") as fp:
+                dump_index = cls.read(fp)
+        except FileNotFoundError:
+            return None
+        except (ValueError, struct.error):
+            logging.warning("Index is outdated and ignored. Run `kit.py index` again.")
+            return None
+        if dump_index.size != os.path.getsize(dump):
+            logging.warning("Index is built for another dump and ignored. Run `kit.py index` again.")
+            return None
+        return dump_index
+
+    @classmethod
+    def read(cls, fp) -> "DumpIndex":
+        magic, interval, size, count = cls.HEADER.unpack(fp.read(cls.HEADER.size))
+        if magic != cls.MAGIC:
+            raise ValueError("not an index file")
+        return cls(interval, size, *read_packed_arrays(fp, 2, count))
+
+    def write(self, fp):
+        fp.write(self.HEADER.pack(self.MAGIC, self.interval, self.size, len(self.account_ids)))
+        write_packed_arrays(fp, self.account_ids, self.offsets)
+
+    def find(self, account_id: int) -> typing.Optional[int]:
+        """Gets offset of the last indexed record not greater than the account ID."""
+        i = bisect.bisect_right(self.account_ids, account_id)
+        return self.offsets[i - 1] if i else None
+
+
+def find_account_stats(fp, account_id: int, dump_index: DumpIndex = None) -> typing.Optional[typing.List["Tank"]]:
+    """
+    Finds account tanks in dump.
+    Uses block directory of version 2 dump or the index. Otherwise scans the whole dump.
+    """
+    fp.seek(0)
+    reader = DumpReader(fp, block_size=65536)
+    if reader.version == 2:
+        first_account_ids, offsets = reader.read_directory()
+        i = bisect.bisect_right(first_account_ids, account_id)
+        if not i:
+            return None
+        reader.seek(offsets[i - 1])
+    elif dump_index is not None:
+        offset = dump_index.find(account_id)
+        if offset is None:
+            return None
+        reader.seek(offset)
+    else:
+        reader.block_size = BLOCK_SIZE
+    for other_account_id, tanks in reader:
+        if other_account_id == account_id:
+            return tanks
+        if other_account_id > account_id:
+            return None
+    return None
+
+
+# Verification.
+# ------------------------------------------------------------------------------
+
+class DumpChecksums:
+    """
+    CRC32 checksums of fixed-size dump chunks. Stored next to the dump.
+    Used for dumps which don't have block checksums.
+    """
+
+    EXTENSION = ".crc"
+    MAGIC = b"WOTCRC32"
+    HEADER = struct.Struct("<8sQQQ")  # magic, chunk size, dump size, checksum count
+
+    def __init__(self, chunk_size: int, size: int, crcs: array.array):
+        self.chunk_size = chunk_size
+        self.size = size
+        self.crcs = crcs
+
+    @classmethod
+    def build(cls, fp, chunk_size: int) -> "DumpChecksums":
+        """Computes checksums of the dump."""
+        size, crcs = 0, array.array("I")
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            crcs.append(zlib.crc32(chunk))
+        return cls(chunk_size, size, crcs)
+
+    @classmethod
+    def load(cls, dump: str) -> typing.Optional["DumpChecksums"]:
+        """Loads checksums of the dump if they exist."""
+        try:
+            with open(dump + cls.EXTENSION, "rb") as fp:
+                return cls.read(fp)
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def read(cls, fp) -> "DumpChecksums":
+        magic, chunk_size, size, count = cls.HEADER.unpack(fp.read(cls.HEADER.size))
+        if magic != cls.MAGIC:
+            raise ValueError("not a checksum file")
+        crcs, = read_packed_arrays(fp, 1, count, "I")
+        return cls(chunk_size, size, crcs)
+
+    def write(self, fp):
+        fp.write(self.HEADER.pack(self.MAGIC, self.chunk_size, self.size, len(self.crcs)))
+        write_packed_arrays(fp, self.crcs)
+
+
+def verify_blocks(dump: str, offsets) -> typing.Optional[int]:
+    """Checks version 2 dump blocks at the offsets. Returns offset of the first bad block."""
+    with open(dump, "rb") as fp:
+        reader = DumpReader(fp)
+        for offset in offsets:
+            reader.seek(offset)
+            try:
+                reader.read_frame()
+            except ValueError:
+                return offset
+    return None
+
+
+def verify_frames(dump: str) -> typing.Optional[int]:
+    """Checks version 2 dump blocks sequentially up to the terminator. Returns offset of the first bad block."""
+    with open(dump, "rb") as fp:
+        reader = DumpReader(fp)
+        while True:
+            offset = reader.tell()
+            try:
+                if reader.read_frame() is None:
+                    return None
+            except ValueError:
+                return offset
+
+
+def verify_chunks(dump: str, chunk_size: int, chunks) -> typing.Optional[int]:
+    """Checks (index, crc) dump chunks. Returns offset of the first bad chunk."""
+    with open(dump, "rb") as fp:
+        for index, crc in chunks:
+            fp.seek(index * chunk_size)
+            if zlib.crc32(fp.read(chunk_size)) != crc:
+                return index * chunk_size
+    return None
+
+
+# Checkpoints.
+# ------------------------------------------------------------------------------
+
+class CrawlCheckpoint:
+    """
+    State of `get` stored next to the output as JSON. Written atomically.
+    The output is truncated to the checkpoint offset on resume.
+    """
+
+    EXTENSION = ".checkpoint"
+
+    def __init__(
+        self, expected_id: int, account_count: int, tank_count: int, last_existing_id: typing.Optional[int],
+        offset: int, writer_state: dict, end_id: int = None, selector_state: dict = None,
+    ):
+        self.expected_id = expected_id
+        self.account_count = account_count
+        self.tank_count = tank_count
+        self.last_existing_id = last_existing_id
+        self.offset = offset
+        self.writer_state = writer_state
+        self.end_id = end_id
+        self.selector_state = selector_state
+
+    @classmethod
+    def load(cls, dump: str) -> typing.Optional["CrawlCheckpoint"]:
+        """Loads checkpoint of the dump if it exists."""
+        try:
+            with open(dump + cls.EXTENSION, "rt", encoding="utf-8") as fp:
+                return cls(**json.load(fp))
+        except FileNotFoundError:
+            return None
+
+    def write(self, dump: str):
+        path = dump + self.EXTENSION
+        with open(path + ".tmp", "wt", encoding="utf-8") as fp:
+            json.dump(self.__dict__, fp, sort_keys=True)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def remove(cls, dump: str):
+        try:
+            os.remove(dump + cls.EXTENSION)
+        except FileNotFoundError:
+            pass
+
+
+# Partitioning.
+# ------------------------------------------------------------------------------
+
+class Partition(collections.namedtuple("Partition", "start end start_id end_id")):
+    """Byte range of dump and account ID range of its records."""
+
+
+def find_record(fp, offset: int, size=65536) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    Finds offset and account ID of the first plausible record at or after the offset of version 1 dump.
+    Candidate record must be followed by several plausible records or by the end of file.
+    """
+    while True:
+        fp.seek(offset)
+        buffer = fp.read(size)
+        is_last = len(buffer) < size
+        position = buffer.find(b">>")
+        while position != -1:
+            values, _ = decode_uvarints(buffer[position:])
+            index, last_account_id = 0, -1
+            for _ in range(RESYNC_RECORD_COUNT):
+                end = check_record(values, index, last_account_id, is_last)
+                if end is None or end == -1:
+                    break
+                index, last_account_id = end, values[index + 2]
+            if (end is not None and end != -1) or (end == -1 and is_last and index):
+                return offset + position, values[2]
+            if end == -1 and not is_last:
+                break  # the record doesn't fit into the buffer
+            position = buffer.find(b">>", position + 1)
+        else:
+            if is_last:
+                return None
+            offset += max(len(buffer) - 1, 1)  # the last byte may be the first half of the marker
+            continue
+        size *= 2
+
+
+def find_record_offset(reader: DumpReader, account_id: int, dump_index: DumpIndex = None) -> int:
+    """
+    Finds offset to read the account and the following ones from.
+    Uses block directory of version 2 dump or the index. Otherwise bisects the dump resyncing on records.
+    """
+    if reader.version == 2:
+        first_account_ids, offsets = reader.read_directory()
+        i = bisect.bisect_right(first_account_ids, account_id)
+        return offsets[i - 1] if i else reader.offset
+    if dump_index is not None:
+        offset = dump_index.find(account_id)
+        return offset if offset is not None else reader.offset
+    offset, low, high = reader.offset, reader.offset, reader.fp.seek(0, os.SEEK_END)
+    while high - low > BLOCK_SIZE:
+        middle = (low + high) // 2
+        record = find_record(reader.fp, middle)
+        if record is None or record[1] >= account_id:
+            high = middle
+        else:
+            offset, low = record[0], middle
+    return offset
+
+
+def partition_dump(dump: str, count: int) -> typing.List[Partition]:
+    """
+    Splits dump into up to count partitions aligned on record or block boundaries.
+    Uses block directory of version 2 dump or the index. Otherwise resyncs on record markers.
+    """
+    with open(dump, "rb") as fp:
+        reader = DumpReader(fp)
+        size = fp.seek(0, os.SEEK_END)
+        if reader.version == 2:
+            account_ids, offsets = reader.read_directory()
+        else:
+            dump_index = DumpIndex.load(dump)
+            if dump_index is not None:
+                account_ids, offsets = dump_index.account_ids, dump_index.offsets
+            else:
+                records = [find_record(fp, size * i // count) for i in range(count)]
+                offsets = [record[0] for record in records if record is not None]
+                account_ids = [record[1] for record in records if record is not None]
+    boundaries = sorted({
+        (offsets[len(offsets) * i // count], account_ids[len(offsets) * i // count])
+        for i in range(count)
+    } if offsets else ())
+    return [
+        Partition(
+            start,
+            boundaries[i + 1][0] if i + 1 < len(boundaries) else size,
+            account_id if i else 0,
+            boundaries[i + 1][1] if i + 1 < len(boundaries) else MAX_ACCOUNT_ID,
+        )
+        for i, (start, account_id) in enumerate(boundaries)
+    ]
+
+
+def read_partition(reader: DumpReader, partition: Partition):
+    """Reads account stats of the partition."""
+    reader.seek(partition.start)
+    for offset, account_id, tanks in reader.records():
+        if offset >= partition.end or account_id >= partition.end_id:
+            break
+        if account_id >= partition.start_id:
+            yield account_id, tanks
+
+
+def read_partition_batches(reader: DumpReader, partition: Partition):
+    """Reads tank batches of the partition."""
+    reader.seek(partition.start)
+    for batch in reader.batches():
+        if not len(batch):
+            continue
+        if batch.account_ids[0] >= partition.end_id:
+            break
+        yield batch.select(partition.start_id, partition.end_id)
+        if batch.account_ids[-1] >= partition.end_id:
+            break
+
+
+def map_partitions(func, dump: str, partitions, jobs: int, *args):
+    """
+    Runs func(dump, partition, *args) in worker processes.
+    Yields results in partition order keeping a limited number of them pending.
+    """
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = collections.deque()
+        for partition in partitions:
+            futures.append(executor.submit(func, dump, partition, *args))
+            if len(futures) >= 2 * jobs:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
 # Enumeration.
 # ------------------------------------------------------------------------------
 
@@ -523,6 +3286,167 @@ class AccountTank(collections.namedtuple("AccountTank", "account_id tank_id batt
         return (self.account_id, self.tank_id)
 
 
+class TankBatch:
+    """
+    Tanks of many accounts kept in parallel array("I") columns, one entry per tank.
+    Indexing gives lightweight views which behave like AccountTank. Accounts without tanks are not kept.
+    """
+
+    __slots__ = ("account_ids", "tank_ids", "battles", "wins")
+
+    def __init__(self):
+        self.account_ids = array.array("I")
+        self.tank_ids = array.array("I")
+        self.battles = array.array("I")
+        self.wins = array.array("I")
+
+    @classmethod
+    def from_records(cls, records: list) -> "TankBatch":
+        """Makes batch of (account_id, tanks) records."""
+        batch = cls()
+        batch.account_ids.extend(itertools.chain.from_iterable(
+            itertools.repeat(account_id, len(tanks)) for account_id, tanks in records))
+        for column, values in zip(batch.columns(), zip(*itertools.chain.from_iterable(tanks for _, tanks in records))):
+            column.extend(values)
+        return batch
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "TankBatch":
+        """Makes batch of DumpReader.columns() batch."""
+        batch = cls()
+        batch.account_ids.extend(itertools.chain.from_iterable(
+            map(itertools.repeat, columns["account_ids"], columns["tank_counts"])))
+        batch.tank_ids.extend(columns["tank_ids"])
+        batch.battles.extend(columns["battles"])
+        batch.wins.extend(columns["wins"])
+        return batch
+
+    @classmethod
+    def from_values(cls, values: list, boundaries: list) -> "TankBatch":
+        """Makes batch of decoded record values. See decode_block."""
+        batch, tanks = cls(), []
+        for start, end in zip(boundaries, boundaries[1:]):
+            batch.account_ids.extend(itertools.repeat(values[start + 2], values[start + 3]))
+            tanks.extend(values[start + 4:end])
+        batch.tank_ids.extend(tanks[0::3])
+        batch.battles.extend(tanks[1::3])
+        batch.wins.extend(tanks[2::3])
+        return batch
+
+    def columns(self) -> typing.Tuple[array.array, array.array, array.array]:
+        """Gets tank ID, battles and wins columns."""
+        return self.tank_ids, self.battles, self.wins
+
+    def select(self, start_id: int, end_id: int) -> "TankBatch":
+        """Gets batch of the accounts within the ID range."""
+        start, end = bisect.bisect_left(self.account_ids, start_id), bisect.bisect_left(self.account_ids, end_id)
+        if not start and end == len(self):
+            return self
+        batch = TankBatch()
+        batch.account_ids, batch.tank_ids = self.account_ids[start:end], self.tank_ids[start:end]
+        batch.battles, batch.wins = self.battles[start:end], self.wins[start:end]
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.tank_ids)
+
+    def __getitem__(self, index: int) -> "AccountTankView":
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("batch index out of range")
+        return AccountTankView(self, index)
+
+    def __iter__(self):
+        return map(partial(AccountTankView, self), range(len(self)))
+
+    def records(self):
+        """Yields (account_id, tank views) records."""
+        account_ids, count, start = self.account_ids, len(self), 0
+        while start < count:
+            account_id, end = account_ids[start], start + 1
+            while end < count and account_ids[end] == account_id:
+                end += 1
+            yield account_id, [TankView(self, index) for index in range(start, end)]
+            start = end
+
+
+class BatchView:
+    """Base of TankBatch entry views. Views behave like the corresponding namedtuples."""
+
+    __slots__ = ("batch", "index")
+    _fields = ()
+
+    def __init__(self, batch: TankBatch, index: int):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def account_id(self) -> int:
+        return self.batch.account_ids[self.index]
+
+    @property
+    def tank_id(self) -> int:
+        return self.batch.tank_ids[self.index]
+
+    @property
+    def battles(self) -> int:
+        return self.batch.battles[self.index]
+
+    @property
+    def wins(self) -> int:
+        return self.batch.wins[self.index]
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __iter__(self):
+        return iter(self.astuple())
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return self.astuple()[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, (tuple, BatchView)):
+            return NotImplemented
+        return self.astuple() == tuple(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, (tuple, BatchView)):
+            return NotImplemented
+        return self.astuple() < tuple(other)
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name)) for name in self._fields))
+
+
+class TankView(BatchView):
+
+    __slots__ = ()
+    _fields = Tank._fields
+
+
+class AccountTankView(BatchView):
+
+    __slots__ = ()
+    _fields = AccountTank._fields
+
+    def key(self):
+        return (self.account_id, self.tank_id)
+
+
+def make_batches(records, batch_size=BATCH_SIZE):
+    """Packs (account_id, tanks) records into tank batches."""
+    return map(TankBatch.from_records, chop(records, batch_size))
+
+
 def chop(iterable, length: int):
     """Splits iterable into chunks."""
     iterable = iter(iterable)
@@ -540,13 +3464,9 @@ def safe_next(iterator):
         return None
 
 
-def enumerate_tanks(fp):
-    """Reads all tanks from file."""
-    while True:
-        stats = read_account_stats(fp)
-        if not stats:
-            return
-        account_id, tanks = stats
+def enumerate_tanks(records):
+    """Reads all tanks from file, dump reader or account stats."""
+    for account_id, tanks in (DumpReader(records) if hasattr(records, "read") else records):
         for tank in tanks:
             tank_id, battles, wins = tank
             yield AccountTank(account_id, tank_id, battles, wins)
@@ -573,6 +3493,123 @@ def enumerate_diff(old_iterator, new_iterator):
             old, new = safe_next(old_iterator), safe_next(new_iterator)
 
 
+def tag_records(records, index: int):
+    """Adds input index to the records."""
+    for account_id, tanks in records:
+        yield account_id, index, tanks
+
+
+def merge_records(inputs, key):
+    """
+    Merges sorted record iterables by account ID.
+    Duplicate account is resolved by the maximum key(index, tanks) where index is the input position.
+    Yields account ID, tanks and number of inputs containing the account.
+    """
+    merged = heapq.merge(*(tag_records(records, index) for index, records in enumerate(inputs)))
+    for account_id, candidates in itertools.groupby(merged, itemgetter(0)):
+        candidates = list(candidates)
+        _, _, tanks = max(candidates, key=lambda candidate: key(candidate[1], candidate[2]))
+        yield account_id, tanks, len(candidates)
+
+
+def enumerate_batch_diff_python(old_batches, new_batches):
+    """
+    Generates diff entries of two tank batch streams. Same as enumerate_diff.
+    Compares raw batch columns so that only the yielded entries are instantiated.
+    """
+    old_batches, new_batches = iter(old_batches), iter(new_batches)
+    old, new = next(old_batches, None), next(new_batches, None)
+    i = j = 0
+    while new is not None:
+        new_account_ids, new_tank_ids, new_battles, new_wins = new.account_ids, new.tank_ids, new.battles, new.wins
+        new_count = len(new)
+        if old is None:
+            for j in range(j, new_count):
+                yield AccountTank(new_account_ids[j], new_tank_ids[j], new_battles[j], new_wins[j])
+            new, j = next(new_batches, None), 0
+            continue
+        old_account_ids, old_tank_ids, old_battles, old_wins = old.account_ids, old.tank_ids, old.battles, old.wins
+        old_count = len(old)
+        while i < old_count and j < new_count:
+            old_account_id, new_account_id = old_account_ids[i], new_account_ids[j]
+            if old_account_id < new_account_id:
+                i += 1
+                continue
+            if old_account_id == new_account_id:
+                old_tank_id, new_tank_id = old_tank_ids[i], new_tank_ids[j]
+                if old_tank_id < new_tank_id:
+                    i += 1
+                    continue
+                if old_tank_id == new_tank_id:
+                    battles, wins = new_battles[j] - old_battles[i], new_wins[j] - old_wins[i]
+                    # Work around strange API behaviors.
+                    if battles > 0 and wins >= 0 and battles >= wins:
+                        yield AccountTank(new_account_id, new_tank_id, battles, wins)
+                    i, j = i + 1, j + 1
+                    continue
+            yield AccountTank(new_account_id, new_tank_ids[j], new_battles[j], new_wins[j])
+            j += 1
+        if i == old_count:
+            old, i = next(old_batches, None), 0
+        if j == new_count:
+            new, j = next(new_batches, None), 0
+
+
+def get_batch_keys_numpy(batch: TankBatch) -> tuple:
+    """Gets (account ID, tank ID) keys, battles and wins of the batch as numpy arrays."""
+    account_ids = numpy.frombuffer(batch.account_ids, dtype=numpy.uint32).astype(numpy.uint64)
+    tank_ids = numpy.frombuffer(batch.tank_ids, dtype=numpy.uint32).astype(numpy.uint64)
+    return (
+        numpy.left_shift(account_ids, numpy.uint64(32)) | tank_ids,
+        numpy.frombuffer(batch.battles, dtype=numpy.uint32).astype(numpy.int64),
+        numpy.frombuffer(batch.wins, dtype=numpy.uint32).astype(numpy.int64),
+    )
+
+
+def enumerate_batch_diff_numpy(old_batches, new_batches):
+    """
+    Vectorized version of enumerate_batch_diff_python.
+    Every new batch is joined with old entries up to its last key by binary search.
+    """
+    old_batches = iter(old_batches)
+    old_keys = numpy.empty(0, dtype=numpy.uint64)
+    old_battles = old_wins = numpy.empty(0, dtype=numpy.int64)
+    for new in new_batches:
+        if not len(new):
+            continue
+        new_keys, new_battles, new_wins = get_batch_keys_numpy(new)
+        # Take old entries up to the last new key.
+        while old_batches is not None and (not len(old_keys) or old_keys[-1] < new_keys[-1]):
+            old = next(old_batches, None)
+            if old is None:
+                old_batches = None
+            elif len(old):
+                keys, battles, wins = get_batch_keys_numpy(old)
+                old_keys = numpy.concatenate((old_keys, keys))
+                old_battles, old_wins = numpy.concatenate((old_battles, battles)), numpy.concatenate((old_wins, wins))
+        split = numpy.searchsorted(old_keys, new_keys[-1], side="right")
+        keys, battles, wins = old_keys[:split], old_battles[:split], old_wins[:split]
+        old_keys, old_battles, old_wins = old_keys[split:], old_battles[split:], old_wins[split:]
+        if len(keys):
+            indexes = numpy.minimum(numpy.searchsorted(keys, new_keys), len(keys) - 1)
+            found = keys[indexes] == new_keys
+            battles = numpy.where(found, new_battles - battles[indexes], new_battles)
+            wins = numpy.where(found, new_wins - wins[indexes], new_wins)
+            # Work around strange API behaviors.
+            mask = ~found | ((battles > 0) & (wins >= 0) & (battles >= wins))
+        else:
+            battles, wins, mask = new_battles, new_wins, numpy.ones(len(new), dtype=bool)
+        yield from map(AccountTank._make, zip(
+            numpy.frombuffer(new.account_ids, dtype=numpy.uint32)[mask].tolist(),
+            numpy.frombuffer(new.tank_ids, dtype=numpy.uint32)[mask].tolist(),
+            battles[mask].tolist(),
+            wins[mask].tolist(),
+        ))
+
+
+enumerate_batch_diff = enumerate_batch_diff_python if numpy is None else enumerate_batch_diff_numpy
+
+
 # Entry point.
 # ------------------------------------------------------------------------------
 
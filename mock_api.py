@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+"""
+Local stand-in for Wargaming Public API. Serves synthetic data for crawl benchmarks.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+
+from aiohttp import web
+import click
+
+import encyclopedia
+import kit
+
+
+TANK_IDS = sorted(encyclopedia.TANKS)
+
+# Longer than the client request timeout.
+TIMEOUT_SLEEP = 30.0
+
+# Last battle time of inactive accounts.
+INACTIVE_AGE = 30 * 86400
+
+LATENCIES = {
+    "constant": lambda mean, sd: mean,
+    "normal": lambda mean, sd: random.normalvariate(mean, sd),
+    "lognormal": lambda mean, sd: random.lognormvariate(*get_lognormal_parameters(mean, sd)),
+    "exponential": lambda mean, sd: random.expovariate(1.0 / mean) if mean else 0.0,
+}
+
+
+def get_lognormal_parameters(mean: float, sd: float):
+    """Gets mu and sigma of the log-normal distribution with the given mean and standard deviation."""
+    if not mean:
+        return float("-inf"), 0.0
+    sigma_2 = math.log(1.0 + (sd / mean) ** 2)
+    return math.log(mean) - sigma_2 / 2.0, math.sqrt(sigma_2)
+
+
+def make_account_info(account_id: int, existing_rate: float, active_rate: float, now: float, seed=0):
+    """Generates account info. Active accounts have just played."""
+    if random.Random(account_id * 1000003 + seed).random() >= existing_rate:
+        return None
+    is_active = random.Random(account_id * 1000003 + seed + 1).random() < active_rate
+    return {"account_id": account_id, "last_battle_time": int(now if is_active else now - INACTIVE_AGE)}
+
+
+def make_account_tanks(account_id: int, existing_rate: float, seed=0):
+    """Generates account tanks. The same account always gets the same tanks."""
+    generator = random.Random(account_id * 1000003 + seed)
+    if generator.random() >= existing_rate:
+        return None
+    tanks = []
+    for tank_id in sorted(generator.sample(TANK_IDS, min(int(generator.expovariate(0.05)), len(TANK_IDS)))):
+        battles = 1 + int(generator.expovariate(0.01))
+        tanks.append({
+            "statistics": {"battles": battles, "wins": generator.randint(0, battles)},
+            "tank_id": tank_id,
+        })
+    return tanks
+
+
+def filter_fields(tank: dict, fields: str) -> dict:
+    """Leaves the requested fields only."""
+    if not fields:
+        return tank
+    return {field: tank[field] for field in fields.split(",") if field in tank}
+
+
+class MockApi:
+    """Serves API methods with configurable faults."""
+
+    def __init__(
+        self, latency: str, latency_mean: float, latency_sd: float, existing_rate: float, active_rate: float,
+        quota: float, limit_rate: float, timeout_rate: float, error_rate: float, seed: int,
+    ):
+        self.latency = lambda: LATENCIES[latency](latency_mean, latency_sd)
+        self.existing_rate = existing_rate
+        self.active_rate = active_rate
+        self.start_time = time.time()
+        self.quota = quota
+        self.limit_rate = limit_rate
+        self.timeout_rate = timeout_rate
+        self.error_rate = error_rate
+        self.seed = seed
+        self.buckets = {}
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("GET", "/wot/account/info/", self.handle(self.account_info))
+        app.router.add_route("GET", "/wot/account/tanks/", self.handle(self.account_tanks))
+        app.router.add_route("GET", "/wot/encyclopedia/tanks/", self.handle(self.encyclopedia_tanks))
+        app.router.add_route("GET", "/wot/encyclopedia/tankinfo/", self.handle(self.encyclopedia_tankinfo))
+        return app
+
+    def handle(self, method):
+        """Wraps the method with latency, faults and JSON encoding."""
+        @asyncio.coroutine
+        def handler(request):
+            params = request.GET
+            yield from asyncio.sleep(max(self.latency(), 0.0))
+            if random.random() < self.timeout_rate:
+                yield from asyncio.sleep(TIMEOUT_SLEEP)
+            if random.random() < self.error_rate:
+                return web.Response(status=random.choice([500, 502, 503, 504]))
+            if random.random() < self.limit_rate or not self.acquire(params.get("application_id")):
+                return self.make_response({
+                    "status": "error",
+                    "error": {"code": 407, "field": None, "message": "REQUEST_LIMIT_EXCEEDED", "value": None},
+                })
+            data = method(params)
+            return self.make_response({"status": "ok", "meta": {"count": len(data)}, "data": data})
+        return handler
+
+    def acquire(self, app_id: str) -> bool:
+        """Checks the application ID quota."""
+        if not self.quota:
+            return True
+        bucket = self.buckets.get(app_id)
+        if bucket is None:
+            bucket = self.buckets[app_id] = kit.TokenBucket(self.quota, capacity=self.quota)
+        if bucket.wait_time():
+            return False
+        bucket.take()
+        return True
+
+    def account_info(self, params) -> dict:
+        account_ids = map(int, params["account_id"].split(","))
+        fields = params.get("fields", "")
+        infos = {
+            str(account_id): make_account_info(
+                account_id, self.existing_rate, self.active_rate, self.start_time, self.seed)
+            for account_id in account_ids
+        }
+        return {account_id: filter_fields(info, fields) if info else None for account_id, info in infos.items()}
+
+    def account_tanks(self, params) -> dict:
+        account_ids = map(int, params["account_id"].split(","))
+        return {
+            str(account_id): make_account_tanks(account_id, self.existing_rate, self.seed)
+            for account_id in account_ids
+        }
+
+    def encyclopedia_tanks(self, params) -> dict:
+        fields = params.get("fields", "")
+        return {str(tank_id): filter_fields(tank, fields) for tank_id, tank in encyclopedia.TANKS.items()}
+
+    def encyclopedia_tankinfo(self, params) -> dict:
+        fields = params.get("fields", "")
+        tanks = {tank_id: encyclopedia.TANKS.get(int(tank_id)) for tank_id in params["tank_id"].split(",")}
+        return {tank_id: filter_fields(tank, fields) if tank else None for tank_id, tank in tanks.items()}
+
+    @staticmethod
+    def make_response(body: dict) -> web.Response:
+        return web.Response(text=json.dumps(body), content_type="application/json")
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Host to listen on.", show_default=True)
+@click.option("--port", default=8080, help="Port to listen on.", show_default=True, type=int)
+@click.option(
+    "--latency", default="lognormal", help="Latency distribution.", show_default=True,
+    type=click.Choice(sorted(LATENCIES)),
+)
+@click.option("--latency-mean", default=0.2, help="Mean latency.", metavar="<seconds>", show_default=True, type=float)
+@click.option(
+    "--latency-sd", default=0.1, help="Latency standard deviation.", metavar="<seconds>", show_default=True, type=float,
+)
+@click.option("--existing-rate", default=0.6, help="Fraction of existing accounts.", show_default=True, type=float)
+@click.option(
+    "--active-rate", default=0.1, help="Fraction of accounts played after the server start.", show_default=True,
+    type=float,
+)
+@click.option("--quota", default=0.0, help="Requests per second per application ID, 0 for unlimited.", type=float)
+@click.option("--limit-rate", default=0.0, help="Fraction of REQUEST_LIMIT_EXCEEDED errors.", type=float)
+@click.option("--timeout-rate", default=0.0, help="Fraction of requests hanging for %.0fs." % TIMEOUT_SLEEP, type=float)
+@click.option("--error-rate", default=0.0, help="Fraction of HTTP server errors.", type=float)
+@click.option("--seed", default=0, help="Synthetic data seed.", show_default=True, type=int)
+def main(host: str, port: int, **kwargs):
+    """
+    Run mock API server. Point kit.py at it with --api-url http://<host>:<port>/wot.
+    """
+    logging.basicConfig(
+        format="%(asctime)s (%(module)s) %(levelname)s %(message)s",
+        level=logging.INFO,
+        stream=sys.stderr,
+    )
+    mock_api = MockApi(**kwargs)
+    web.run_app(mock_api.make_app(), host=host, port=port)
+
+
+if __name__ == "__main__":
+    main()
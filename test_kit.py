@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
+import asyncio
 import io
+import json
+import os
 
 import pytest
 
@@ -23,6 +26,13 @@ def test_write_uvarint(value, expected):
     assert fp.getvalue() == expected
 
 
+@pytest.mark.parametrize(("value", "expected"), uvarint_argvalues)
+def test_encode_uvarint(value, expected):
+    buffer = bytearray(b">>")
+    kit.encode_uvarint(value, buffer)
+    assert buffer == b">>" + expected
+
+
 @pytest.mark.parametrize(("expected", "bytes_"), uvarint_argvalues)
 def test_read_uvarint(bytes_, expected):
     value = kit.read_uvarint(io.BytesIO(bytes_))
@@ -43,11 +53,523 @@ def test_write_account_stats():
     assert fp.getvalue() == b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05"
 
 
+def test_account_stats_writer():
+    fp = io.BytesIO()
+    writer = kit.AccountStatsWriter(fp)
+    assert writer.write(3, [kit.AccountTank(3, 270, 86942, 86941)]) == 1
+    assert writer.write(4, []) == 0
+    assert fp.getvalue() == b""
+    writer.flush()
+    assert fp.getvalue() == b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00"
+    writer.append(io.BytesIO(b">>\x05\x00"))
+    assert fp.getvalue().endswith(b">>\x04\x00>>\x05\x00")
+    assert writer.offset == len(fp.getvalue()) == 20
+
+
 def test_read_account_stats():
     fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05")
     assert kit.read_account_stats(fp) == (3, [kit.Tank(270, 86942, 86941)])
 
 
+@pytest.mark.parametrize("block_size", [5, kit.BLOCK_SIZE])
+def test_dump_reader_tolerant(block_size):
+    fp = io.BytesIO(
+        b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05"
+        b">>\x04\x00"  # followed by bad marker
+        b"><\x05\x00"  # bad marker
+        b">>\x06\x01\x01\x02\x01"
+        b">>\x7F\x00"  # corrupted account ID
+        b">>\x07\x00"
+        b">>\x08\x01\x01"  # truncated
+    )
+    reader = kit.DumpReader(fp, block_size=block_size, tolerant=True)
+    assert list(reader) == [(3, [kit.Tank(270, 86942, 86941)]), (6, [kit.Tank(1, 2, 1)]), (7, [])]
+    assert reader.skipped_size == 17
+
+
+@pytest.mark.parametrize("is_truncated", [False, True])
+def test_dump_reader_tolerant_blocks(is_truncated):
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp, block_size=1)
+    for account_id in range(3, 6):
+        writer.write(account_id, [kit.Tank(1, account_id, 0)])
+    writer.close()
+    data = bytearray(fp.getvalue())
+    data[writer.offsets[1] + 6] ^= 0xFF
+    if is_truncated:
+        del data[-kit.DUMP_TAIL.size:]
+    reader = kit.DumpReader(io.BytesIO(bytes(data)), tolerant=True)
+    expected = [(3, [kit.Tank(1, 3, 0)])] if is_truncated else [(3, [kit.Tank(1, 3, 0)]), (5, [kit.Tank(1, 5, 0)])]
+    assert list(reader) == expected
+
+
+def test_prefetch_file():
+    fp = kit.PrefetchFile(io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00"), 2, chunk_size=3)
+    assert fp.read(2) == b">>"
+    assert fp.read(5) == b"\x03\x01\x8E\x02\x9E"
+    assert fp.tell() == 7
+    assert fp.seek(12) == 12
+    assert fp.read() == b">>\x04\x00"
+    assert fp.read(1) == b""
+
+
+def test_prefetch_error():
+    def items():
+        yield 1
+        raise ValueError("bad item")
+    with pytest.raises(ValueError):
+        list(kit.prefetch(items(), 1))
+
+
+@pytest.mark.parametrize("block_size", [5, kit.BLOCK_SIZE])
+def test_dump_reader_prefetch(block_size):
+    fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00")
+    reader = kit.DumpReader(fp, block_size=block_size, prefetch=2)
+    assert list(reader) == [(3, [kit.Tank(270, 86942, 86941)]), (4, [])]
+
+
+@pytest.mark.parametrize("compression", list(kit.COMPRESSIONS))
+def test_compressed_file(compression):
+    data = b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00"
+    fp = io.BytesIO()
+    output = kit.CompressedFile(fp, compression)
+    output.write(data[:7])
+    output.write(bytearray(data[7:]))
+    assert output.tell() == len(data)
+    output.close()
+    fp.seek(0)
+    assert kit.detect_compression(fp) == compression
+    input_ = kit.DecompressedFile(fp, compression)
+    assert list(kit.DumpReader(input_)) == [(3, [kit.Tank(270, 86942, 86941)]), (4, [])]
+    input_.close()
+    fp.seek(0)
+    input_ = kit.DecompressedFile(fp, compression)
+    with pytest.raises(kit.click.ClickException):
+        list(kit.DumpReader(input_, use_mmap=True))
+    input_.close()
+
+
+def test_dump_index(tmpdir):
+    fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00>>\x06\x00")
+    dump_index = kit.DumpIndex.build(kit.DumpReader(fp), 2, 20)
+    assert (list(dump_index.account_ids), list(dump_index.offsets)) == ([3, 6], [0, 16])
+    path = tmpdir.join("dump")
+    path.write_binary(fp.getvalue())
+    with open(str(path) + kit.DumpIndex.EXTENSION, "wb") as index_fp:
+        dump_index.write(index_fp)
+    dump_index = kit.DumpIndex.load(str(path))
+    assert (dump_index.interval, dump_index.size) == (2, 20)
+    assert (list(dump_index.account_ids), list(dump_index.offsets)) == ([3, 6], [0, 16])
+    assert [dump_index.find(account_id) for account_id in (2, 3, 5, 7)] == [None, 0, 0, 16]
+    assert kit.find_account_stats(fp, 3, dump_index) == [kit.Tank(270, 86942, 86941)]
+    assert kit.find_account_stats(fp, 4, dump_index) == []
+    assert kit.find_account_stats(fp, 5, dump_index) is None
+    assert kit.find_account_stats(fp, 6) == []
+    path.write_binary(fp.getvalue()[:16])
+    assert kit.DumpIndex.load(str(path)) is None
+
+
+@pytest.mark.parametrize("codec", list(kit.CODECS))
+@pytest.mark.parametrize("layout", kit.LAYOUTS)
+def test_block_dump_writer(codec, layout):
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp, codec, layout, block_size=10)
+    writer.write(3, [kit.Tank(270, 86942, 86941)])
+    writer.write(4, [])
+    writer.write(6, [kit.Tank(1, 2, 1)])
+    writer.close()
+    fp.seek(0)
+    reader = kit.DumpReader(fp)
+    assert reader.version == 2
+    assert (reader.header["codec"], reader.header["layout"]) == (codec, layout)
+    assert list(reader) == [(3, [kit.Tank(270, 86942, 86941)]), (4, []), (6, [kit.Tank(1, 2, 1)])]
+    fp.seek(0)
+    batches = kit.DumpReader(fp).columns(["battles"])
+    assert [battles for columns in batches for battles in columns["battles"]] == [86942, 2]
+    first_account_ids, offsets = reader.read_directory()
+    assert list(first_account_ids) == [3, 4]
+    footer = reader.read_footer()
+    assert footer == {"account_count": 3, "tank_count": 2, "last_existing_id": 6, "size": len(fp.getvalue())}
+    assert kit.find_account_stats(fp, 4) == []
+    assert kit.find_account_stats(fp, 5) is None
+    assert kit.find_account_stats(fp, 6) == [kit.Tank(1, 2, 1)]
+
+
+def test_dump_reader_pipe():
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp)
+    writer.write(3, [kit.Tank(270, 86942, 86941)])
+    writer.close()
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, fp.getvalue())
+    os.close(write_fd)
+    with open(read_fd, "rb", buffering=0) as pipe:
+        reader = kit.DumpReader(pipe)
+        assert reader.tell() == writer.offsets[0]
+        assert list(reader) == [(3, [kit.Tank(270, 86942, 86941)])]
+
+
+def test_columnar_block():
+    block = kit.ColumnarBlock()
+    block.write(3, [kit.Tank(270, 86942, 86941), kit.Tank(300, 1, 0)])
+    block.write(4, [])
+    buffer = block.pop()
+    assert buffer == b"\x02\x03\x01\x02\x02\x00\x03\x8E\x02\x1E\x04\x9E\xA7\x05\x01\x04\x9D\xA7\x05\x00"
+    assert kit.ColumnarBlock.decode_columns(buffer, 0, ["account_ids", "wins"]) == {
+        "account_ids": [3, 4],
+        "wins": [86941, 0],
+    }
+    assert list(kit.ColumnarBlock.decode(buffer, 0)) == [
+        (3, [kit.Tank(270, 86942, 86941), kit.Tank(300, 1, 0)]),
+        (4, []),
+    ]
+
+
+@pytest.mark.parametrize("layout", kit.LAYOUTS)
+def test_block_dump_writer_tank_index(layout):
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp, layout=layout, tank_index=True, block_size=10)
+    writer.write(3, [kit.Tank(1, 10, 5), kit.Tank(33, 1, 0), kit.Tank(99999, 2, 1)])
+    writer.write(4, [kit.Tank(49, 7, 7), kit.Tank(99998, 1, 1)])
+    writer.close()
+    fp.seek(0)
+    reader = kit.DumpReader(fp)
+    assert reader.header["tank_ids"] == sorted(kit.encyclopedia.TANKS)
+    assert list(reader) == [
+        (3, [kit.Tank(1, 10, 5), kit.Tank(33, 1, 0), kit.Tank(99999, 2, 1)]),
+        (4, [kit.Tank(49, 7, 7), kit.Tank(99998, 1, 1)]),
+    ]
+    assert reader.tank_table.tank_ids[-2:] == [99999, 99998]
+
+
+@pytest.mark.parametrize("layout", kit.LAYOUTS)
+@pytest.mark.parametrize("is_closed", [True, False])
+def test_dump_reader_seek_tank_index(layout, is_closed):
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp, layout=layout, tank_index=True, block_size=1)
+    writer.write(3, [kit.Tank(99999, 2, 1)])
+    writer.write(4, [kit.Tank(1, 10, 5), kit.Tank(99998, 1, 1), kit.Tank(99999, 3, 3)])
+    if is_closed:
+        writer.close()
+    offsets = writer.offsets.tolist()
+    fp.seek(0)
+    reader = kit.DumpReader(fp)
+    reader.seek(offsets[1])
+    assert next(iter(reader)) == (4, [kit.Tank(1, 10, 5), kit.Tank(99998, 1, 1), kit.Tank(99999, 3, 3)])
+    if is_closed:
+        assert kit.find_account_stats(fp, 4) == [kit.Tank(1, 10, 5), kit.Tank(99998, 1, 1), kit.Tank(99999, 3, 3)]
+
+
+@pytest.mark.parametrize("format_", [1, 2])
+def test_resume_dump_writer(tmpdir, format_):
+    path = str(tmpdir.join("dump"))
+    with open(path, "wb") as fp:
+        writer = kit.make_dump_writer(fp, format_, tank_index=True)
+        writer.write(3, [kit.Tank(270, 86942, 86941)])
+        checkpoint = kit.CrawlCheckpoint(4, 1, 1, 3, 0, writer.checkpoint())
+        checkpoint.offset = fp.tell()
+        checkpoint.write(path)
+        writer.write(4, [kit.Tank(99999, 1, 1)])  # lost on resume
+        writer.flush()
+    checkpoint = kit.CrawlCheckpoint.load(path)
+    assert (checkpoint.expected_id, checkpoint.last_existing_id) == (4, 3)
+    with open(path, "r+b") as fp:
+        writer = kit.resume_dump_writer(fp, checkpoint)
+        writer.write(5, [kit.Tank(99998, 2, 1)])
+        writer.close()
+    with open(path, "rb") as fp:
+        assert list(kit.DumpReader(fp)) == [(3, [kit.Tank(270, 86942, 86941)]), (5, [kit.Tank(99998, 2, 1)])]
+
+
+def test_crawl_checkpoint(tmpdir):
+    path = str(tmpdir.join("dump"))
+    selector = kit.AccountIdSelector(kit.ExistenceBitmap.from_records([(5, [])]), 0.25, phase=3)
+    with open(path, "wb") as fp:
+        consumer = kit.AccountTanksConsumer(1, kit.AccountStatsWriter(fp), selector)
+        consumer.checkpoint(fp, 1000).write(path)
+    checkpoint = kit.CrawlCheckpoint.load(path)
+    assert (checkpoint.expected_id, checkpoint.end_id) == (5, 1000)
+    selector = kit.AccountIdSelector(kit.ExistenceBitmap.from_records([(5, [])]), 0.25)
+    selector.restore(checkpoint.selector_state)
+    assert (selector.sample_period, selector.phase) == (4, 3)
+
+
+def test_dump_checksums(tmpdir):
+    path = tmpdir.join("dump")
+    path.write_binary(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00")
+    with path.open("rb") as fp:
+        checksums = kit.DumpChecksums.build(fp, 4)
+    assert (checksums.size, len(checksums.crcs)) == (16, 4)
+    fp = io.BytesIO()
+    checksums.write(fp)
+    fp.seek(0)
+    checksums = kit.DumpChecksums.read(fp)
+    assert kit.verify_chunks(str(path), 4, enumerate(checksums.crcs)) is None
+    path.write_binary(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x05\x00")
+    assert kit.verify_chunks(str(path), 4, enumerate(checksums.crcs)) == 12
+
+
+def test_verify_blocks(tmpdir):
+    path = tmpdir.join("dump")
+    with path.open("wb") as fp:
+        writer = kit.BlockDumpWriter(fp, block_size=1)
+        writer.write(3, [kit.Tank(270, 86942, 86941)])
+        writer.write(4, [])
+        writer.close()
+    with path.open("rb") as fp:
+        _, offsets = kit.DumpReader(fp).read_directory()
+    assert kit.verify_blocks(str(path), offsets) is None
+    data = bytearray(path.read_binary())
+    data[offsets[1] + 6] ^= 0xFF
+    path.write_binary(bytes(data))
+    assert kit.verify_blocks(str(path), offsets) == offsets[1]
+
+
+def test_verify_frames(tmpdir):
+    path = tmpdir.join("dump")
+    with path.open("wb") as fp:
+        writer = kit.BlockDumpWriter(fp, block_size=1)
+        writer.write(3, [kit.Tank(270, 86942, 86941)])
+        writer.write(4, [])
+        writer.close()
+    with path.open("rb") as fp:
+        reader = kit.DumpReader(fp)
+        directory_offset, _ = reader.read_tail()
+        _, offsets = reader.read_directory()
+    data = path.read_binary()
+    path.write_binary(data[:directory_offset])
+    assert kit.verify_frames(str(path)) is None
+    path.write_binary(data[:offsets[1] + 3])
+    assert kit.verify_frames(str(path)) == offsets[1]
+    with path.open("rb") as fp, pytest.raises(ValueError):
+        kit.DumpReader(fp).read_footer()
+
+
+@pytest.mark.parametrize("format_", [1, 2])
+def test_partition_dump(tmpdir, format_):
+    path = tmpdir.join("dump")
+    with path.open("wb") as fp:
+        writer = kit.make_dump_writer(fp, format_)
+        if format_ == 2:
+            writer.block_size = 1
+        for account_id in range(1, 65):
+            writer.write(account_id, [kit.Tank(62, account_id, 62)] * (account_id % 3))
+        writer.close()
+    partitions = kit.partition_dump(str(path), 4)
+    assert len(partitions) == 4
+    assert [partition.start_id for partition in partitions] == [0, 17, 33, 49]
+    records = []
+    with path.open("rb") as fp:
+        reader = kit.DumpReader(fp)
+        for partition in partitions:
+            records.extend(kit.read_partition(reader, partition))
+        fp.seek(0)
+        assert records == list(kit.DumpReader(fp))
+
+
+def test_find_record():
+    fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00>>\x05\x01\x3E\x3E\x3E>>\x06\x00")
+    assert kit.find_record(fp, 0) == (0, 3)
+    assert kit.find_record(fp, 1) == (12, 4)
+    assert kit.find_record(fp, 17) == (23, 6)
+    assert kit.find_record(fp, 24) is None
+
+
+@pytest.mark.parametrize(("start_id", "end_id", "count", "expected"), [
+    (0, 9, 1, [(0, 9)]),
+    (0, 9, 3, [(0, 2), (3, 5), (6, 9)]),
+    (5, 6, 3, [(5, 4), (5, 5), (6, 6)]),
+])
+def test_split_id_range(start_id, end_id, count, expected):
+    assert kit.split_id_range(start_id, end_id, count) == expected
+
+
+@pytest.mark.parametrize(("policy", "expected"), [
+    ("newest", [(1, [kit.Tank(1, 2, 1)], 1), (2, [kit.Tank(1, 3, 2)], 2), (3, [], 1)]),
+    ("battles", [(1, [kit.Tank(1, 2, 1)], 1), (2, [kit.Tank(1, 5, 1)], 2), (3, [], 1)]),
+])
+def test_merge_records(policy, expected):
+    old = [(1, [kit.Tank(1, 2, 1)]), (2, [kit.Tank(1, 5, 1)])]
+    new = [(2, [kit.Tank(1, 3, 2)]), (3, [])]
+    assert list(kit.merge_records([old, new], kit.MERGE_POLICIES[policy])) == expected
+
+
+def test_existence_bitmap():
+    bitmap = kit.ExistenceBitmap.from_records([(3, []), (17, []), (3, [])])
+    assert len(bitmap) == 2
+    assert 3 in bitmap and 17 in bitmap and 4 not in bitmap and 1000 not in bitmap
+    assert [bitmap.next(i) for i in (0, 3, 4, 17, 18)] == [3, 3, 17, 17, None]
+    assert bitmap.max() == 17
+    assert kit.ExistenceBitmap().max() is None
+
+
+def test_select_account_ids():
+    bitmap = kit.ExistenceBitmap.from_records([(5, []), (250, []), (900, [])])
+    selector = kit.AccountIdSelector(bitmap, 0.5, phase=0)
+    assert list(kit.select_account_ids(150, 1000, selector)) == (
+        list(range(200, 300)) + list(range(400, 500)) + list(range(600, 700)) + list(range(800, 1001)))
+    selector = kit.AccountIdSelector(bitmap, 0.5, phase=1)
+    assert list(kit.select_account_ids(150, 1000, selector)) == (
+        list(range(150, 200)) + [250] + list(range(300, 400)) + list(range(500, 600)) + list(range(700, 800)) +
+        list(range(900, 1001)))
+    assert kit.AccountIdSelector(bitmap, 0.5).phase in (0, 1)
+    selector = kit.AccountIdSelector(kit.ExistenceBitmap.from_records([(5, []), (250, [])]))
+    assert list(kit.select_account_ids(1, 253, selector)) == [5, 250, 251, 252, 253]
+
+
+def test_aimd_rate_controller(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(kit, "time", lambda: now[0])
+    controller = kit.AimdRateController(4.0, min_rate=1.0, max_rate=5.0)
+    controller.on_success(0.1)
+    assert controller.rate == 4.25
+    controller.on_error()
+    assert controller.rate == 2.125
+    controller.on_error()  # within the cooldown
+    assert controller.rate == 2.125
+    now[0] += kit.RATE_DECREASE_COOLDOWN
+    controller.on_success(kit.SLOW_RESPONSE_TIME)
+    assert controller.rate == 1.0625
+    for _ in range(100):
+        controller.on_success(0.1)
+    assert controller.rate == 5.0
+
+
+def test_token_bucket(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(kit, "time", lambda: now[0])
+    bucket = kit.TokenBucket(2.0, capacity=3.0)
+    now[0] += 0.25
+    bucket.refill()
+    assert bucket.tokens == 3.0
+    bucket.tokens = 0.0
+    now[0] += 0.25
+    bucket.refill()
+    assert bucket.tokens == 0.5
+
+
+def test_key_pool(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(kit, "time", lambda: now[0])
+    keys = [kit.ApiKey("a", kit.AimdRateController(1.0)), kit.ApiKey("b", kit.AimdRateController(1.0))]
+    pool = kit.KeyPool(keys)
+    loop = asyncio.new_event_loop()
+    acquired = [loop.run_until_complete(pool.acquire()).app_id for _ in range(2)]
+    assert sorted(acquired) == ["a", "b"]
+    now[0] += 1.0
+    for _ in range(kit.KEY_FAILURE_LIMIT):
+        keys[0].on_error()
+    assert keys[0].wait_time(now[0]) == kit.KEY_SIDELINE_TIME
+    assert loop.run_until_complete(pool.acquire()) is keys[1]
+    monkeypatch.setattr(kit, "normalvariate", lambda mu, sigma: 0.0)
+    key = kit.ApiKey("c")
+    key.on_error()
+    key.on_error()
+    assert key.wait_time(now[0]) == pytest.approx(0.2)
+    key.on_success(0.1)
+    key.on_error()
+    assert key.wait_time(now[0]) == pytest.approx(0.1)
+    loop.close()
+
+
+def test_histogram():
+    histogram = kit.Histogram("latency", "Latency.", (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.format_prometheus() == [
+        "# HELP latency Latency.",
+        "# TYPE latency histogram",
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1.0"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        "latency_sum 2.65",
+        "latency_count 4",
+    ]
+    assert histogram.to_json() == {"buckets": {"0.1": 2, "1.0": 3, "+Inf": 4}, "sum": 2.65, "count": 4}
+
+
+def test_crawl_metrics(tmpdir):
+    metrics = kit.CrawlMetrics()
+    consumer = kit.AccountTanksConsumer(5, None)
+    consumer.buffer[7] = []
+    metrics.update(consumer, 8, 100, 10.0)
+    assert "kit_buffer_size 1\n" in metrics.format_prometheus()
+    path = str(tmpdir.join("metrics.json"))
+    metrics.write_json(path)
+    with open(path, "rt") as fp:
+        values = json.load(fp)
+    assert values["kit_expected_id"] == 5 and values["kit_max_pending_count"] == 8
+    assert values["kit_written_bytes"] == 100 and values["kit_request_rate"] == 10.0
+
+
+class SlowFirstApi:
+    """Answers slowly to the first request only."""
+
+    def __init__(self):
+        self.metrics = kit.CrawlMetrics()
+        self.call_count = 0
+
+    @asyncio.coroutine
+    def account_tanks(self, account_ids):
+        self.call_count += 1
+        yield from asyncio.sleep(10.0 if self.call_count == 1 else 0.001)
+        return [(account_id, []) for account_id in account_ids]
+
+
+def test_hedged_requests():
+    api = SlowFirstApi()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    pending = kit.HedgedRequests(api)
+    pending.durations.extend([0.01] * kit.HEDGE_MIN_SAMPLES)
+    pending.schedule([1, 2])
+    done = loop.run_until_complete(pending.wait(1))
+    assert [task.result() for task in done] == [[(1, []), (2, [])]]
+    assert api.call_count == 2 and api.metrics.hedged_requests.value == 1
+    assert len(pending) == 0
+    loop.close()
+
+
+@pytest.mark.parametrize("merge_fan_in", [2, kit.SPILL_MERGE_FAN_IN])
+def test_spilling_consumer(tmpdir, merge_fan_in):
+    fp = io.BytesIO()
+    consumer = kit.SpillingConsumer(
+        1, kit.AccountStatsWriter(fp), str(tmpdir), segment_size=1, merge_fan_in=merge_fan_in)
+    tank = {"tank_id": 1, "statistics": {"battles": 2, "wins": 1}}
+    consumer.consume([(4, [tank]), (3, None)])
+    assert consumer.expected_id == 1
+    consumer.consume([(6, [tank]), (5, [tank])])
+    consumer.consume([(2, [tank]), (1, [tank, tank])])
+    assert consumer.expected_id == 7
+    assert (consumer.account_count, consumer.tank_count, consumer.last_existing_id) == (5, 6, 6)
+    consumer.merge()
+    consumer.writer.close()
+    assert len(consumer.paths) == 3
+    assert not tmpdir.listdir()
+    fp.seek(0)
+    assert [account_id for account_id, _ in kit.DumpReader(fp)] == [1, 2, 4, 5, 6]
+
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_incremental_writer(tmpdir, spill):
+    fp = io.BytesIO()
+    base = [(account_id, [kit.Tank(1, account_id, 1)]) for account_id in (1, 3, 5, 6, 7)]
+    writer = kit.IncrementalWriter(kit.AccountStatsWriter(fp), base)
+    if spill:
+        consumer = kit.SpillingConsumer(2, writer, str(tmpdir))
+    else:
+        consumer = kit.AccountTanksConsumer(2, writer)
+    tank = {"tank_id": 2, "statistics": {"battles": 1, "wins": 1}}
+    consumer.consume([(2, [tank]), (3, [tank]), (4, None), (5, []), (6, None)])
+    if spill:
+        consumer.merge()
+    writer.close()
+    assert writer.copied_count == 2
+    fp.seek(0)
+    assert list(kit.DumpReader(fp)) == [
+        (1, [kit.Tank(1, 1, 1)]), (2, [kit.Tank(2, 1, 1)]), (3, [kit.Tank(2, 1, 1)]), (7, [kit.Tank(1, 7, 1)])]
+
+
 def test_enumerate_tanks():
     fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05")
     assert list(kit.enumerate_tanks(fp)) == [kit.AccountTank(3, 270, 86942, 86941)]
@@ -75,3 +597,90 @@ def test_enumerate_diff():
         kit.AccountTank(2, 5, 1, 0),
     ]
     assert list(kit.enumerate_diff(old, new)) == expected
+
+
+def test_tank_batch():
+    records = [(3, [kit.Tank(1, 10, 5), kit.Tank(270, 86942, 86941)]), (4, []), (5, [kit.Tank(2, 1, 0)])]
+    batch = kit.TankBatch.from_records(records)
+    assert len(batch) == 3
+    assert batch[1] == kit.AccountTank(3, 270, 86942, 86941)
+    assert batch[-1].key() == (5, 2)
+    account_id, tank_id, battles, wins = batch[0]
+    assert (account_id, tank_id, battles, wins) == (3, 1, 10, 5)
+    assert list(batch.records()) == [records[0], records[2]]
+    assert list(batch.select(4, 6)) == [kit.AccountTank(5, 2, 1, 0)]
+    values, _, boundaries = kit.decode_block(b">>\x03\x02\x01\x0A\x05\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00")
+    assert list(kit.TankBatch.from_values(values, boundaries)) == list(batch)[:2]
+
+
+@pytest.mark.parametrize("enumerate_batch_diff", [kit.enumerate_batch_diff_python, kit.enumerate_batch_diff_numpy])
+def test_enumerate_batch_diff(enumerate_batch_diff):
+    if enumerate_batch_diff is kit.enumerate_batch_diff_numpy and kit.numpy is None:
+        pytest.skip("numpy is not installed")
+    old = [
+        kit.TankBatch.from_records([(1, [kit.Tank(1, 10, 5), kit.Tank(3, 2, 1)]), (2, [kit.Tank(4, 1, 0)])]),
+        kit.TankBatch.from_records([(3, [kit.Tank(1, 10, 5)]), (4, [kit.Tank(5, 3, 1)])]),
+    ]
+    new = [
+        kit.TankBatch.from_records([(1, [kit.Tank(2, 12, 6), kit.Tank(3, 3, 2)])]),
+        kit.TankBatch.from_records([(2, [kit.Tank(4, 1, 0), kit.Tank(5, 1, 0)]), (3, [kit.Tank(1, 11, 4)])]),
+        kit.TankBatch.from_records([(4, [kit.Tank(5, 4, 3)]), (6, [kit.Tank(1, 1, 1)])]),
+    ]
+    assert list(enumerate_batch_diff(old, new)) == [
+        kit.AccountTank(1, 2, 12, 6),
+        kit.AccountTank(1, 3, 1, 1),
+        kit.AccountTank(2, 5, 1, 0),
+        kit.AccountTank(6, 1, 1, 1),
+    ]
+
+
+@pytest.mark.parametrize("enumerate_batch_diff", [kit.enumerate_batch_diff_python, kit.enumerate_batch_diff_numpy])
+def test_enumerate_batch_diff_tank_index(enumerate_batch_diff):
+    if enumerate_batch_diff is kit.enumerate_batch_diff_numpy and kit.numpy is None:
+        pytest.skip("numpy is not installed")
+    fp = io.BytesIO()
+    writer = kit.BlockDumpWriter(fp, layout="columns", tank_index=True)
+    writer.write(3, [kit.Tank(1, 10, 5), kit.Tank(99999, 2, 1)])
+    writer.write(4, [kit.Tank(49, 7, 7), kit.Tank(99998, 1, 1), kit.Tank(99999, 3, 3)])
+    writer.close()
+    fp.seek(0)
+    batches = list(kit.DumpReader(fp).batches())
+    assert [batch.tank_ids.tolist() for batch in batches] == [[1, 99999, 49, 99998, 99999]]
+    assert list(enumerate_batch_diff(batches, batches)) == []
+
+
+@pytest.mark.parametrize("decode_uvarints", [kit.decode_uvarints_python, kit.decode_uvarints_numpy])
+def test_decode_uvarints(decode_uvarints):
+    if decode_uvarints is kit.decode_uvarints_numpy and kit.numpy is None:
+        pytest.skip("numpy is not installed")
+    values, ends = decode_uvarints(b"\x00\x03\x8E\x02\x9E\xA7\x05\x9E")
+    assert (values, ends) == ([0, 3, 270, 86942], [1, 2, 4, 7])
+
+
+def test_decode_block():
+    buffer = b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00>>\x05\x01"
+    values, ends, boundaries = kit.decode_block(buffer)
+    assert values[:7] == [62, 62, 3, 1, 270, 86942, 86941]
+    assert boundaries == [0, 7, 11]
+    assert ends[boundaries[-1] - 1] == 16
+
+
+@pytest.mark.parametrize("block_size", [5, kit.BLOCK_SIZE])
+def test_dump_reader(block_size):
+    fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00")
+    reader = kit.DumpReader(fp, block_size=block_size)
+    assert list(reader.records()) == [(0, 3, [kit.Tank(270, 86942, 86941)]), (12, 4, [])]
+    assert reader.tell() == 16
+
+
+def test_dump_reader_mmap(tmpdir):
+    path = tmpdir.join("dump")
+    path.write_binary(b">>\x03\x01\x8E\x02\x9E\xA7\x05\x9D\xA7\x05>>\x04\x00")
+    with path.open("rb") as fp:
+        assert list(kit.DumpReader(fp, block_size=5, use_mmap=True)) == [(3, [kit.Tank(270, 86942, 86941)]), (4, [])]
+
+
+def test_dump_reader_truncated():
+    fp = io.BytesIO(b">>\x03\x01\x8E\x02\x9E")
+    with pytest.raises(ValueError):
+        list(kit.DumpReader(fp))
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import math
+
+import mock_api
+
+
+def test_make_account_tanks():
+    tanks = mock_api.make_account_tanks(42, 1.0)
+    assert tanks == mock_api.make_account_tanks(42, 1.0)
+    assert [tank["tank_id"] for tank in tanks] == sorted(tank["tank_id"] for tank in tanks)
+    assert all(0 <= tank["statistics"]["wins"] <= tank["statistics"]["battles"] for tank in tanks)
+    assert mock_api.make_account_tanks(42, 0.0) is None
+
+
+def test_make_account_info():
+    assert mock_api.make_account_info(42, 1.0, 1.0, 1000000.0) == {"account_id": 42, "last_battle_time": 1000000}
+    assert mock_api.make_account_info(42, 1.0, 0.0, 1000000.0)["last_battle_time"] < 1000000
+    assert mock_api.make_account_info(42, 0.0, 1.0, 1000000.0) is None
+
+
+def test_get_lognormal_parameters():
+    mu, sigma = mock_api.get_lognormal_parameters(0.2, 0.1)
+    assert abs(math.exp(mu + sigma ** 2 / 2.0) - 0.2) < 1e-9
+    assert abs(math.sqrt((math.exp(sigma ** 2) - 1.0) * math.exp(2.0 * mu + sigma ** 2)) - 0.1) < 1e-9